@@ -0,0 +1,28 @@
+# app/datasources/grid.py
+from __future__ import annotations
+import math
+from typing import NamedTuple
+
+# Malla MERRA-2 (base de los parámetros meteorológicos de POWER): 0.5° lat × 0.625° lon
+LAT_STEP = 0.5
+LON_STEP = 0.625
+_N_LON = int(round(360 / LON_STEP))
+
+class GridCell(NamedTuple):
+    lat: float
+    lon: float
+
+    @property
+    def key(self) -> str:
+        """Clave estable para cachés/almacén (p. ej. '19.500_-90.625')."""
+        return f"{self.lat:.3f}_{self.lon:.3f}"
+
+def snap(lat: float, lon: float) -> GridCell:
+    """
+    Centro de la celda de la malla que contiene (lat, lon).
+    Dos puntos dentro de la misma celda reciben los mismos datos de POWER.
+    """
+    i = math.floor((float(lat) + 90) / LAT_STEP + 0.5)
+    j = math.floor((float(lon) + 180) / LON_STEP + 0.5) % _N_LON
+    glat = min(max(-90 + i * LAT_STEP, -90.0), 90.0)
+    return GridCell(glat, -180 + j * LON_STEP)
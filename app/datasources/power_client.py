@@ -1,6 +1,13 @@
+import asyncio
+import calendar
 from datetime import date, timedelta
+import numpy as np
 import pandas as pd
-from app.utils.http import get_json
+from app.config import settings
+from app.datasources.grid import snap
+from app.datasources.power_store import store
+from app.utils.http import get_json, get_json_async
+from app.utils.singleflight import SingleFlight
 from app.utils.timewin import to_yyyymmdd
 
 BASE = "https://power.larc.nasa.gov/api/temporal/daily/point"
@@ -9,31 +16,210 @@ def build_url(lat, lon, start_yyyymmdd, end_yyyymmdd, params):
     return (f"{BASE}?parameters={','.join(params)}&community=RE"
             f"&latitude={lat}&longitude={lon}&start={start_yyyymmdd}&end={end_yyyymmdd}&format=JSON")
 
-def parse_power_json(payload: dict) -> pd.DataFrame:
+FILL_VALUE = -999.0  # valor de relleno de POWER (dato faltante)
+
+def _parse_dates(keys) -> np.ndarray:
+    """'YYYYMMDD' → datetime64[D], vectorizado."""
+    ymd = np.asarray(keys, dtype="U8").astype(np.int64)
+    y, m, d = ymd // 10000, ymd // 100 % 100, ymd % 100
+    months = (y - 1970) * 12 + (m - 1)
+    return months.astype("datetime64[M]").astype("datetime64[D]") + (d - 1).astype("timedelta64[D]")
+
+def parse_power_columns(payload: dict):
+    """
+    Parser columnar: un arreglo NumPy por variable, alineado a un índice de fechas común.
+    El valor de relleno (-999) se convierte en NaN. Retorna (fechas datetime64[D], {var: arreglo float64}).
+    """
     p = payload["properties"]["parameter"]
-    any_var = next(iter(p))
-    rows = []
-    for day_key in p[any_var].keys():
-        row = {"date": day_key}
-        for var, series in p.items():
-            row[var] = series.get(day_key, None)
-        rows.append(row)
-    df = pd.DataFrame(rows)
-    df["date"] = pd.to_datetime(df["date"], format="%Y%m%d")
-    return df.sort_values("date").reset_index(drop=True)
-
-def fetch_window_all_years(lat, lon, month, day, start_year, end_year, half_window_days, params):
-    import datetime as dt
-    rows = []
-    for y in range(start_year, end_year+1):
+    fill = float(payload.get("header", {}).get("fill_value", FILL_VALUE))
+    keys = list(p[next(iter(p))].keys())
+    dates = _parse_dates(keys)
+    cols = {}
+    for var, series in p.items():
+        if list(series.keys()) == keys:
+            values = list(series.values())
+        else:  # variable con otro orden/días: alinear por fecha
+            values = [series.get(k) for k in keys]
+        arr = np.array(values, dtype=np.float64)  # None → NaN
+        arr[arr == fill] = np.nan
+        cols[var] = arr
+    if dates.size > 1 and not (np.diff(dates) > np.timedelta64(0, "D")).all():
+        order = np.argsort(dates, kind="stable")
+        dates = dates[order]
+        cols = {var: arr[order] for var, arr in cols.items()}
+    return dates, cols
+
+def parse_power_json(payload: dict) -> pd.DataFrame:
+    dates, cols = parse_power_columns(payload)
+    return pd.DataFrame({"date": dates.astype("datetime64[ns]"), **cols})
+
+def year_windows(month, day, start_year, end_year, half_window_days):
+    """
+    Ventanas [inicio, fin] (inclusive) alrededor de month/day para cada año.
+    Retorna lista de (año, inicio, fin).
+    """
+    out = []
+    for y in range(start_year, end_year + 1):
         c = date(y, month, day)
-        start = (c - dt.timedelta(days=half_window_days)).strftime("%Y%m%d")
-        end = (c + dt.timedelta(days=half_window_days)).strftime("%Y%m%d")
-        url = build_url(lat, lon, start, end, params)
-        payload = get_json(url)
-        df = parse_power_json(payload)
-        df["year"] = y
-        rows.append(df)
-    out = pd.concat(rows, ignore_index=True)
+        out.append((y, c - timedelta(days=half_window_days), c + timedelta(days=half_window_days)))
+    return out
+
+def plan_ranges(windows, max_span_days=None, max_gap_days=None):
+    """
+    Planificador de descargas: cubre todas las ventanas con el mínimo de rangos
+    contiguos. Une ventanas consecutivas mientras el rango no supere max_span_days
+    (por defecto settings.power_max_range_years); normalmente queda una sola llamada.
+    max_gap_days evita unir ventanas separadas por huecos grandes (p. ej. años ya en disco).
+    """
+    if max_span_days is None:
+        max_span_days = settings.power_max_range_years * 366
+    ranges = []
+    for _, start, end in sorted(windows, key=lambda w: w[1]):
+        if (ranges and (end - ranges[-1][0]).days < max_span_days
+                and (max_gap_days is None or (start - ranges[-1][1]).days <= max_gap_days)):
+            if end > ranges[-1][1]:
+                ranges[-1][1] = end
+            continue
+        ranges.append([start, end])
+    return [(s, e) for s, e in ranges]
+
+def slice_windows(df: pd.DataFrame, windows) -> pd.DataFrame:
+    """
+    Recorta localmente cada ventana anual del DataFrame diario (ordenado por fecha)
+    y etiqueta la columna `year` con el año de la ventana.
+    """
+    dates = df["date"].values
+    parts = []
+    for y, start, end in windows:
+        i = np.searchsorted(dates, np.datetime64(start), side="left")
+        j = np.searchsorted(dates, np.datetime64(end), side="right")
+        part = df.iloc[i:j].copy()
+        part["year"] = y
+        parts.append(part)
+    return pd.concat(parts, ignore_index=True)
+
+def _year_frame(year: int, values: dict) -> pd.DataFrame:
+    days = np.arange(np.datetime64(f"{year}-01-01"), np.datetime64(f"{year + 1}-01-01"))
+    df = pd.DataFrame({"date": days.astype("datetime64[ns]")})
+    for var, arr in values.items():
+        arr = np.array(arr, dtype=np.float64)
+        arr[arr == FILL_VALUE] = np.nan
+        df[var] = arr
+    return df
+
+def _plan(cell, windows, params):
+    """
+    Decide qué se lee del almacén local y qué se pide a POWER.
+    Años cerrados que faltan → se descargan completos (y se guardan al llegar);
+    años abiertos → solo la parte de cada ventana.
+    Retorna (frames_locales, rangos_a_descargar).
+    """
+    use_store = settings.power_store_enabled
+    local, intervals = [], []
+    for y in sorted({y for _, s, e in windows for y in range(s.year, e.year + 1)}):
+        if use_store and store.is_final(y):
+            cached = store.get_year(cell.key, params, y)
+            if cached is not None:
+                local.append(_year_frame(y, cached))
+            else:
+                intervals.append((y, date(y, 1, 1), date(y, 12, 31)))
+    for _, s, e in windows:
+        for y in range(s.year, e.year + 1):
+            if not (use_store and store.is_final(y)):
+                intervals.append((y, max(s, date(y, 1, 1)), min(e, date(y, 12, 31))))
+    # con almacén no se unen rangos por encima de años ya guardados
+    return local, plan_ranges(intervals, max_gap_days=366 if use_store else None)
+
+def _persist(cell, fetched: pd.DataFrame, params):
+    """Congela en disco los años cerrados que llegaron completos y actualiza su índice climatológico."""
+    from app.services import climatology  # import diferido: climatology importa este módulo
+
+    years = fetched["date"].dt.year
+    saved = []
+    for y in years.unique():
+        y = int(y)
+        part = fetched[years == y]
+        if (not store.is_final(y) or len(part) != (366 if calendar.isleap(y) else 365)
+                or not set(params).issubset(part.columns)):
+            continue  # año abierto o incompleto: no se congela
+        for var in params:
+            store.put(cell.key, var, y, pd.to_numeric(part[var], errors="coerce").to_numpy(np.float64))
+        saved.append(y)
+    if saved:
+        climatology.refresh(cell.key, params, saved)
+
+def _parse_range(payload, cell, params) -> pd.DataFrame:
+    df = parse_power_json(payload)
+    if settings.power_store_enabled:
+        _persist(cell, df, params)
+    return df
+
+# Descargas idénticas en vuelo (misma celda, variables y rango) se comparten
+_inflight = SingleFlight()
+
+def _range_key(cell, start, end, params):
+    return (cell.key, tuple(sorted(params)), start, end)
+
+def _fetch_range(cell, start, end, params) -> pd.DataFrame:
+    def run():
+        url = build_url(cell.lat, cell.lon, to_yyyymmdd(start), to_yyyymmdd(end), params)
+        return _parse_range(get_json(url), cell, params)
+    return _inflight.do(_range_key(cell, start, end, params), run)
+
+async def _fetch_range_async(cell, start, end, params) -> pd.DataFrame:
+    async def run():
+        url = build_url(cell.lat, cell.lon, to_yyyymmdd(start), to_yyyymmdd(end), params)
+        # parseo + _persist (escrituras e índice climatológico) fuera del event loop
+        return await asyncio.to_thread(_parse_range, await get_json_async(url), cell, params)
+    return await _inflight.do_async(_range_key(cell, start, end, params), run)
+
+def _daily(frames) -> pd.DataFrame:
+    # los frames descargados pueden estar compartidos entre llamadas: no se mutan
+    daily = pd.concat(frames, ignore_index=True).drop_duplicates("date")
+    return daily.sort_values("date").reset_index(drop=True)
+
+def fetch_daily(cell, windows, params, on_range=None) -> pd.DataFrame:
+    """
+    Serie diaria (date + variables) de una celda que cubre todas las ventanas dadas,
+    con una sola planificación de descargas (útil para agrupar muchas consultas).
+    `on_range(start, end)` se llama al terminar cada rango descargado (progreso).
+    """
+    local, ranges = _plan(cell, windows, params)
+    fetched = []
+    for start, end in ranges:
+        fetched.append(_fetch_range(cell, start, end, params))
+        if on_range:
+            on_range(start, end)
+    return _daily(local + fetched)
+
+async def fetch_daily_async(cell, windows, params, on_range=None) -> pd.DataFrame:
+    local, ranges = _plan(cell, windows, params)
+
+    async def one(start, end):
+        df = await _fetch_range_async(cell, start, end, params)
+        if on_range:
+            on_range(start, end)
+        return df
+    fetched = await asyncio.gather(*(one(start, end) for start, end in ranges))
+    return _daily(local + list(fetched))
+
+def window_frame(daily: pd.DataFrame, windows, cell, lat, lon) -> pd.DataFrame:
+    """Recorta las ventanas anuales de una serie diaria con las columnas de siempre."""
+    out = slice_windows(daily, windows)
     out["lat"] = lat; out["lon"] = lon
+    out["grid_lat"] = cell.lat; out["grid_lon"] = cell.lon
     return out
+
+def fetch_window_all_years(lat, lon, month, day, start_year, end_year, half_window_days, params, on_range=None):
+    windows = year_windows(month, day, start_year, end_year, half_window_days)
+    cell = snap(lat, lon)  # se descarga/guarda por celda de la malla, no por punto exacto
+    return window_frame(fetch_daily(cell, windows, params, on_range), windows, cell, lat, lon)
+
+async def fetch_window_all_years_async(lat, lon, month, day, start_year, end_year, half_window_days, params, on_range=None):
+    """
+    Igual que fetch_window_all_years, pero descarga los rangos planificados en paralelo
+    con el cliente httpx async compartido (sin ocupar el threadpool).
+    """
+    windows = year_windows(month, day, start_year, end_year, half_window_days)
+    cell = snap(lat, lon)  # se descarga/guarda por celda de la malla, no por punto exacto
+    return window_frame(await fetch_daily_async(cell, windows, params, on_range), windows, cell, lat, lon)
@@ -0,0 +1,85 @@
+# app/datasources/power_store.py
+from __future__ import annotations
+import os
+import tempfile
+from datetime import date, timedelta
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+from app.config import settings
+
+class PowerStore:
+    """
+    Almacén local de series diarias POWER: un .npy (float64, 365/366 valores)
+    por (celda, variable, año), leído con memory-map.
+    Solo guarda años "cerrados": el histórico diario ya no cambia.
+    """
+
+    def __init__(self, root: str | os.PathLike, lag_days: int = 90):
+        self.root = Path(root)
+        self.lag_days = lag_days
+
+    def _path(self, cell: str, var: str, year: int) -> Path:
+        return self.root / cell / var / f"{year}.npy"
+
+    def is_final(self, year: int) -> bool:
+        # POWER publica con retraso: un año se congela lag_days después del 31-dic
+        return date(year, 12, 31) + timedelta(days=self.lag_days) < date.today()
+
+    def get(self, cell: str, var: str, year: int) -> Optional[np.ndarray]:
+        try:
+            return np.load(self._path(cell, var, year), mmap_mode="r")
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def put(self, cell: str, var: str, year: int, values: np.ndarray) -> None:
+        self._save(self._path(cell, var, year), np.asarray(values, dtype=np.float64))
+
+    def years(self, cell: str, var: str) -> list[int]:
+        """Años guardados para (celda, variable), ordenados."""
+        try:
+            names = os.listdir(self.root / cell / var)
+        except FileNotFoundError:
+            return []
+        return sorted(int(n[:-4]) for n in names if n.endswith(".npy") and n[:-4].isdigit())
+
+    def get_array(self, cell: str, var: str, name: str) -> Optional[np.ndarray]:
+        """Arreglos derivados (p. ej. índices precomputados) junto a los años."""
+        try:
+            return np.load(self.root / cell / var / f"_{name}.npy", mmap_mode="r")
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def put_array(self, cell: str, var: str, name: str, values: np.ndarray, replace_prefix: str | None = None) -> None:
+        folder = self.root / cell / var
+        if replace_prefix and folder.exists():  # borra versiones previas del mismo derivado
+            for old in folder.glob(f"_{replace_prefix}*.npy"):
+                if old.name != f"_{name}.npy":
+                    old.unlink(missing_ok=True)
+        self._save(folder / f"_{name}.npy", values)
+
+    def _save(self, path: Path, values: np.ndarray) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # escritura atómica: tmp + rename (seguro entre workers)
+        fd, tmp = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.save(f, values)
+            os.replace(tmp, path)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+            raise
+
+    def get_year(self, cell: str, params, year: int) -> Optional[dict]:
+        """Todas las variables de un año, o None si falta alguna."""
+        out = {}
+        for var in params:
+            arr = self.get(cell, var, year)
+            if arr is None:
+                return None
+            out[var] = arr
+        return out
+
+store = PowerStore(settings.power_store_dir, settings.power_store_lag_days)
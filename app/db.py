@@ -1,7 +1,11 @@
-from sqlalchemy import create_engine
+import logging
+from sqlalchemy import create_engine, inspect, text
+from sqlalchemy.exc import DBAPIError
 from sqlalchemy.orm import sessionmaker, DeclarativeBase
 from app.config import settings
 
+log = logging.getLogger("app.db")
+
 engine = create_engine(
     settings.database_url,  # antes: settings.DATABASE_URL
     connect_args={"check_same_thread": False} if settings.database_url.startswith("sqlite") else {},
@@ -10,3 +14,52 @@ engine = create_engine(
 SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False)
 
 class Base(DeclarativeBase): ...
+
+def sync_schema(bind=engine) -> list[str]:
+    """
+    create_all no altera tablas existentes: agrega las columnas que el modelo tiene y la BD no
+    (creada con una versión anterior) y los índices declarados que falten.
+    Solo cambios aditivos y seguros: columnas nullable e índices.
+    Lo demás (NOT NULL, borrar columnas) va a mano; ver scripts/dump.mysql.
+    """
+    insp = inspect(bind)
+    quote = bind.dialect.identifier_preparer.quote
+    applied = []
+
+    def apply(name: str, step) -> None:
+        try:
+            with bind.begin() as conn:
+                step(conn)
+            applied.append(name)
+        except DBAPIError as e:  # p. ej. otro worker que arrancó a la vez ya lo aplicó
+            log.warning("no se pudo aplicar %s: %s", name, e.orig)
+
+    for table in Base.metadata.sorted_tables:
+        if not insp.has_table(table.name):
+            continue
+        have = {c["name"] for c in insp.get_columns(table.name)}
+        for col in table.columns:
+            if col.name in have:
+                continue
+            if not col.nullable:
+                log.warning("columna %s.%s falta en la BD y es NOT NULL: migrar a mano", table.name, col.name)
+                continue
+            ddl = text(f"ALTER TABLE {quote(table.name)} ADD COLUMN {quote(col.name)} "
+                       f"{col.type.compile(dialect=bind.dialect)}")
+            apply(f"{table.name}.{col.name}", lambda conn, ddl=ddl: conn.execute(ddl))
+            have.add(col.name)
+        # por columnas, no por nombre: las tablas de scripts/dump.mysql usan otros nombres (idx_*)
+        indexed = {tuple(i["column_names"]) for i in insp.get_indexes(table.name)}
+        indexed |= {tuple(u["column_names"]) for u in insp.get_unique_constraints(table.name)}
+        for idx in table.indexes:
+            cols = tuple(c.name for c in idx.columns)
+            if cols not in indexed and have.issuperset(cols):
+                apply(idx.name, idx.create)
+    if applied:
+        log.info("esquema actualizado: %s", ", ".join(applied))
+    return applied
+
+def init_schema(bind=engine) -> None:
+    """Crea las tablas que falten y completa las existentes (ver sync_schema)."""
+    Base.metadata.create_all(bind=bind)
+    sync_schema(bind)
@@ -1,11 +1,11 @@
 # app/deps.py
-from typing import Callable
-from fastapi import Depends, HTTPException, status
+from typing import Callable, Optional
+from fastapi import Depends, HTTPException, Query, status
 from fastapi.security import OAuth2PasswordBearer
 from sqlalchemy.orm import Session
 
 from app.db import SessionLocal
-from app.models import User
+from app.principals import Principal, resolve
 from app.security import decode_token
 
 # Swagger vive en /api, así que el tokenUrl debe ser absoluto a ese mount
@@ -18,15 +18,37 @@ def get_db():
     finally:
         db.close()
 
-def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)) -> User:
+def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)) -> Principal:
+    return _user_from_token(token, db)
+
+_optional_bearer = OAuth2PasswordBearer(tokenUrl="/api/v1/auth/token", auto_error=False)
+
+def get_current_user_stream(token: Optional[str] = Depends(_optional_bearer),
+                            access_token: Optional[str] = Query(None)) -> Principal:
+    """
+    Como get_current_user, pero acepta ?access_token= (EventSource no permite headers).
+    Sesión propia y corta (no get_db): un yield-dependency se cierra recién al terminar el stream
+    y retendría una conexión del pool durante todo el SSE.
+    """
+    if not (token or access_token):
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Not authenticated",
+                            headers={"WWW-Authenticate": "Bearer"})
+    with SessionLocal() as db:
+        return _user_from_token(token or access_token, db)
+
+def _user_from_token(token: str, db: Session) -> Principal:
     try:
         payload = decode_token(token)
     except Exception:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Token inválido")
+    # solo access tokens (los emitidos antes no traen `type`): un refresh no abre endpoints protegidos
+    if payload.get("type", "access") != "access":
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Token inválido (no es de acceso)")
     email = payload.get("sub")
     if not email:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Token inválido (sin sub)")
-    user = db.query(User).filter(User.email == email, User.is_active == True).first()
+    # caché de principals: la mayoría de los requests no tocan la BD (ver app/principals.py)
+    user = resolve(payload, db)
     if not user:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Usuario no encontrado/activo")
     return user
@@ -37,9 +59,8 @@ def require_roles(*required: str) -> Callable:
     Uso: @router.get(..., dependencies=[Depends(require_roles('admin','operator'))])
     """
     required_set = {r.lower() for r in required}
-    def _dep(user: User = Depends(get_current_user)) -> User:
-        user_roles = {r.name.lower() for r in (user.roles or [])}
-        if user_roles.isdisjoint(required_set):
+    def _dep(user: Principal = Depends(get_current_user)) -> Principal:
+        if not user.has_any_role(required_set):
             raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Permisos insuficientes (rol requerido)")
         return user
     return _dep
@@ -0,0 +1,68 @@
+# app/domain/climatology.py
+from __future__ import annotations
+import warnings
+from datetime import date
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+MAX_HALF_WINDOW = 30  # igual que el límite de half_window_days en los schemas
+
+def rolling_medians(values: np.ndarray, max_half_window: int = MAX_HALF_WINDOW) -> np.ndarray:
+    """
+    Mediana (ignorando NaN) de la ventana centrada [i-w, i+w] para cada día i
+    y cada w en 0..max_half_window. Retorna arreglo (max_half_window+1, n).
+    """
+    n = values.size
+    pad = np.concatenate([np.full(max_half_window, np.nan), values, np.full(max_half_window, np.nan)])
+    out = np.empty((max_half_window + 1, n))
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)  # ventanas completamente vacías → NaN
+        for w in range(max_half_window + 1):
+            view = sliding_window_view(pad[max_half_window - w:max_half_window + n + w], 2 * w + 1)
+            med = np.median(view, axis=1)
+            bad = np.isnan(med)
+            if bad.any():  # solo las ventanas con huecos pagan nanmedian
+                med[bad] = np.nanmedian(view[bad], axis=1)
+            out[w] = med
+    return out
+
+def extend_medians(values: np.ndarray, medians: np.ndarray, max_half_window: int = MAX_HALF_WINDOW) -> np.ndarray:
+    """
+    Medianas de `values` a partir de las de un prefijo (p. ej. antes de agregar un año).
+    Solo se recalculan los últimos max_half_window días del prefijo (sus ventanas
+    cruzaban el final) y los días nuevos; el resto se copia.
+    """
+    old = medians.shape[1]
+    keep = max(0, old - max_half_window)
+    start = max(0, keep - max_half_window)  # contexto a la izquierda de las columnas recalculadas
+    tail = rolling_medians(values[start:], max_half_window)[:, keep - start:]
+    return np.concatenate([medians[:, :keep], tail], axis=1)
+
+class ClimatologyIndex:
+    """
+    Índice climatológico de una variable en una celda: serie diaria continua desde el
+    1-ene de first_year y, precomputadas, las medianas de ventana para todo día del año
+    y todo half_window (0..30). Una consulta (mes, día, ventana, años) es un gather.
+    """
+
+    def __init__(self, first_year: int, values: np.ndarray, medians: np.ndarray | None = None):
+        self.first_year = first_year
+        self.origin = date(first_year, 1, 1)
+        self.values = values
+        self.medians = rolling_medians(values) if medians is None else medians
+
+    def centers(self, month: int, day: int, years, half_window_days: int) -> np.ndarray | None:
+        """Índice del día central de cada año; None si alguna ventana cae fuera de la serie."""
+        idx = np.array([(date(y, month, day) - self.origin).days for y in years], dtype=np.int64)
+        if idx.size == 0 or idx.min() < half_window_days or idx.max() + half_window_days >= self.values.size:
+            return None
+        return idx
+
+    def per_year_median(self, centers: np.ndarray, half_window_days: int) -> np.ndarray:
+        return self.medians[half_window_days, centers]
+
+    def window_values(self, centers: np.ndarray, half_window_days: int) -> np.ndarray:
+        """Valores diarios de todas las ventanas, (n_años, 2w+1)."""
+        offsets = np.arange(-half_window_days, half_window_days + 1)
+        return self.values[centers[:, None] + offsets[None, :]]
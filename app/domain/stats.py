@@ -1,102 +1,137 @@
 import numpy as np
 import pandas as pd
 
+def _pkey(q) -> str:
+    q = float(q)
+    return f"p{int(q) if q.is_integer() else q}"
+
 def percentiles(series: pd.Series, qs=(10, 33.3, 66.6, 90)):
     data = pd.to_numeric(series, errors="coerce").dropna().values
     if data.size == 0: return {}
     vals = np.percentile(data, qs)
-    return {f"p{int(q if q.is_integer() else q)}": float(round(v, 3)) for q, v in zip(qs, vals)}
+    return {_pkey(q): float(round(v, 3)) for q, v in zip(qs, vals)}
+
+def _select(conds, labels, default, *values):
+    """np.select sobre arreglos o escalares; NaN en cualquier entrada → insufficient-data."""
+    arrs = np.broadcast_arrays(*[np.asarray(v, dtype=np.float64) for v in values])
+    nan = np.logical_or.reduce([np.isnan(a) for a in arrs])
+    with np.errstate(invalid="ignore"):
+        out = np.select([nan] + [c(*arrs) for c in conds], ["insufficient-data"] + labels, default=default)
+    return out.item() if out.ndim == 0 else out
 
 def classify_temperature(value, p10, p90):
-    if any(np.isnan([value, p10, p90])): return "insufficient-data"
-    if value <= p10: return "very cold"
-    if value >= p90: return "very hot"
-    return "normal"
+    return _select([lambda v, lo, hi: v <= lo, lambda v, lo, hi: v >= hi],
+                   ["very cold", "very hot"], "normal", value, p10, p90)
 
 def classify_wind(value, p90):
-    if any(np.isnan([value, p90])): return "insufficient-data"
-    return "very windy" if value >= p90 else "normal"
+    return _select([lambda v, hi: v >= hi], ["very windy"], "normal", value, p90)
 
 def classify_humidity(value, p90):
-    if any(np.isnan([value, p90])): return "insufficient-data"
-    return "very wet (humidity)" if value >= p90 else "normal"
+    return _select([lambda v, hi: v >= hi], ["very wet (humidity)"], "normal", value, p90)
 
 def simple_heat_index_c(t2m_c, rh_pct):
-    if any(np.isnan([t2m_c, rh_pct])): return np.nan
-    return float(round(t2m_c + 0.2 * (rh_pct - 40) / 10.0, 2))
+    """Índice de calor simplificado; acepta escalares o arreglos (NaN se propaga)."""
+    t = np.asarray(t2m_c, dtype=np.float64)
+    rh = np.asarray(rh_pct, dtype=np.float64)
+    hi = np.round(t + 0.2 * (rh - 40) / 10.0, 2)
+    return float(hi) if hi.ndim == 0 else hi
 
 def classify_comfort(value_hi, p10, p90):
-    if any(np.isnan([value_hi, p10, p90])): return "insufficient-data"
-    if value_hi <= p10: return "very uncomfortable (cold)"
-    if value_hi >= p90: return "very uncomfortable (hot)"
-    return "comfortable/normal"
+    return _select([lambda v, lo, hi: v <= lo, lambda v, lo, hi: v >= hi],
+                   ["very uncomfortable (cold)", "very uncomfortable (hot)"], "comfortable/normal",
+                   value_hi, p10, p90)
+
+# factor → (columna, unidades, percentiles, decimales de "typical", clasificador)
+_YEARLY_FACTORS = {
+    "temperature": ("T2M", "°C", (10, 90), 2, lambda v, p: classify_temperature(v, p.get("p10", np.nan), p.get("p90", np.nan))),
+    "windspeed": ("WS10M", "m/s", (90,), 2, lambda v, p: classify_wind(v, p.get("p90", np.nan))),
+    "humidity": ("RH2M", "%", (90,), 1, lambda v, p: classify_humidity(v, p.get("p90", np.nan))),
+    "comfort": ("HI", "°C (HI)", (10, 90), 2, lambda v, p: classify_comfort(v, p.get("p10", np.nan), p.get("p90", np.nan))),
+}
+_ORDER = ("temperature", "windspeed", "humidity", "precipitation", "comfort")
+_NON_VARS = {"year", "date", "lat", "lon", "grid_lat", "grid_lon"}
+
+def yearly_inputs(df: pd.DataFrame):
+    """Medianas por año de la ventana (una sola pasada agrupada) + valores diarios de precipitación."""
+    var_cols = [c for c in df.columns if c not in _NON_VARS and pd.api.types.is_numeric_dtype(df[c])]
+    per_year = df.groupby("year")[var_cols].median().reset_index()
+    precip = df["PRECTOTCORR"] if "PRECTOTCORR" in df.columns else None
+    return per_year, precip
 
 def analyze_multifactor(df: pd.DataFrame, factors, half_window_days: int):
-    results = {}
-    per_year = df.groupby("year").median(numeric_only=True).reset_index()
-
-    if "T2M" in df.columns and "temperature" in factors:
-        p = percentiles(per_year["T2M"], qs=(10, 90))
-        typical = float(round(per_year["T2M"].median(), 2))
-        results["temperature"] = {
-            "units": "°C",
-            "n_years": int(per_year["year"].nunique()),
-            "typical": typical,
-            "percentiles": p,
-            "label": classify_temperature(typical, p.get("p10", np.nan), p.get("p90", np.nan)),
-        }
-
-    if "WS10M" in df.columns and "windspeed" in factors:
-        p = percentiles(per_year["WS10M"], qs=(90,))
-        typical = float(round(per_year["WS10M"].median(), 2))
-        results["windspeed"] = {
-            "units": "m/s",
-            "n_years": int(per_year["year"].nunique()),
-            "typical": typical,
-            "percentiles": p,
-            "label": classify_wind(typical, p.get("p90", np.nan)),
-        }
-
-    if "RH2M" in df.columns and "humidity" in factors:
-        p = percentiles(per_year["RH2M"], qs=(90,))
-        typical = float(round(per_year["RH2M"].median(), 1))
-        results["humidity"] = {
-            "units": "%",
-            "n_years": int(per_year["year"].nunique()),
-            "typical": typical,
-            "percentiles": p,
-            "label": classify_humidity(typical, p.get("p90", np.nan)),
-        }
-
-    if "PRECTOTCORR" in df.columns and "precipitation" in factors:
-        values = pd.to_numeric(df["PRECTOTCORR"], errors="coerce").dropna()
-        th = 1.0
-        n_days = int(values.size)
-        p_wet = round(float((values >= th).mean()), 3) if n_days else np.nan
-        rainy = values[values >= th]
-        p_int = percentiles(rainy, qs=(50, 90)) if rainy.size else {}
-        label = "very wet (rain)" if rainy.size and rainy.median() >= p_int.get("p90", np.inf) else "normal"
-        results["precipitation"] = {
-            "units": "mm/day",
-            "n_years": int(df["year"].nunique()),
-            "window_days": half_window_days,
-            "n_days_total": n_days,
-            "wet_threshold_mm": th,
-            "prob_wet_day": p_wet,
-            "intensity_percentiles": p_int,
-            "label": label,
-        }
-
-    if "comfort" in factors and {"T2M","RH2M"}.issubset(per_year.columns):
-        per_year["HI"] = per_year.apply(lambda r: simple_heat_index_c(r["T2M"], r["RH2M"]), axis=1)
-        p = percentiles(per_year["HI"], qs=(10, 90))
-        typical = float(round(per_year["HI"].median(), 2))
-        results["comfort"] = {
-            "units": "°C (HI)",
-            "n_years": int(per_year["year"].nunique()),
-            "typical": typical,
-            "percentiles": p,
-            "label": classify_comfort(typical, p.get("p10", np.nan), p.get("p90", np.nan)),
-        }
+    per_year, precip = yearly_inputs(df)
+    return summarize_factors(per_year, precip, factors, half_window_days)
 
+def _yearly_stats(matrix: np.ndarray, spec_qs):
+    """
+    Medianas y percentiles de todas las columnas (factores) a la vez.
+    Retorna (typical sin redondear, [dict percentiles por columna]).
+    """
+    valid = ~np.isnan(matrix)
+    has_data = valid.any(axis=0)
+    typical = np.full(matrix.shape[1], np.nan)
+    pcts = [{} for _ in spec_qs]
+    if has_data.any():
+        cols = matrix[:, has_data]
+        typical[has_data] = pd.DataFrame(cols).median().to_numpy()  # misma mediana que pandas por columna
+        all_qs = sorted({float(q) for qs in spec_qs for q in qs})
+        table = np.nanpercentile(cols, all_qs, axis=0)  # (n_qs, n_cols)
+        for k, j in enumerate(np.flatnonzero(has_data)):
+            by_q = dict(zip(all_qs, table[:, k]))  # np.float64: mismo redondeo que percentiles()
+            pcts[j] = {_pkey(q): float(round(by_q[float(q)], 3)) for q in spec_qs[j]}
+    return typical, pcts
+
+def summarize_factors(per_year: pd.DataFrame, precip, factors, half_window_days: int):
+    """
+    Resultados por factor a partir de las medianas anuales (`per_year`: columna year + variables)
+    y de los valores diarios de precipitación de todas las ventanas (`precip`).
+    """
+    n_years = int(per_year["year"].nunique())
+    columns = {c: per_year[c].to_numpy(dtype=np.float64) for c in per_year.columns if c != "year"}
+    if "comfort" in factors and {"T2M", "RH2M"}.issubset(columns):
+        columns["HI"] = simple_heat_index_c(columns["T2M"], columns["RH2M"])
+
+    # todos los factores anuales en una sola matriz (años × factores)
+    active = [f for f in _ORDER if f in factors and f in _YEARLY_FACTORS and _YEARLY_FACTORS[f][0] in columns]
+    stats = {}
+    if active:
+        matrix = np.column_stack([columns[_YEARLY_FACTORS[f][0]] for f in active])
+        typical, pcts = _yearly_stats(matrix, [_YEARLY_FACTORS[f][2] for f in active])
+        for j, f in enumerate(active):
+            _, units, _, nd, classify = _YEARLY_FACTORS[f]
+            value = float(round(typical[j], nd))
+            stats[f] = {
+                "units": units,
+                "n_years": n_years,
+                "typical": value,
+                "percentiles": pcts[j],
+                "label": classify(value, pcts[j]),
+            }
+
+    results = {}
+    for f in _ORDER:
+        if f in stats:
+            results[f] = stats[f]
+        elif f == "precipitation" and precip is not None and f in factors:
+            results[f] = _precipitation(precip, n_years, half_window_days)
     return results
+
+def _precipitation(precip, n_years: int, half_window_days: int):
+    values = pd.to_numeric(pd.Series(precip), errors="coerce").dropna()
+    th = 1.0
+    n_days = int(values.size)
+    wet = values >= th
+    p_wet = round(float(wet.mean()), 3) if n_days else np.nan
+    rainy = values[wet]
+    p_int = percentiles(rainy, qs=(50, 90)) if rainy.size else {}
+    label = "very wet (rain)" if rainy.size and rainy.median() >= p_int.get("p90", np.inf) else "normal"
+    return {
+        "units": "mm/day",
+        "n_years": n_years,
+        "window_days": half_window_days,
+        "n_days_total": n_days,
+        "wet_threshold_mm": th,
+        "prob_wet_day": p_wet,
+        "intensity_percentiles": p_int,
+        "label": label,
+    }
@@ -0,0 +1 @@
+# app/jobs: cola persistente de análisis + pool de workers (python -m app.jobs.worker)
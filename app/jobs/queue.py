@@ -0,0 +1,141 @@
+# app/jobs/queue.py
+from __future__ import annotations
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import func, select, update, or_
+from sqlalchemy.orm import Session
+
+from app.config import settings
+from app.models import AnalyzeJob, JobStatus, AnalyzeResult, AnalyzeStatus
+
+PRIORITY_SINGLE = 10  # un punto: respuesta rápida
+PRIORITY_BATCH = 0
+
+def utcnow() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+def enqueue(session: Session, analysis_id: int, kind: str = "single", priority: int | None = None,
+            max_attempts: int | None = None) -> AnalyzeJob:
+    """Agrega el job a la sesión (el commit lo hace quien crea la fila de análisis: misma transacción)."""
+    now = utcnow()
+    job = AnalyzeJob(
+        analysis_id=analysis_id,
+        kind=kind,
+        priority=(PRIORITY_SINGLE if kind == "single" else PRIORITY_BATCH) if priority is None else priority,
+        status=JobStatus.queued,
+        attempts=0,
+        max_attempts=max_attempts or settings.job_max_attempts,
+        available_at=now,
+        created_at=now,
+    )
+    session.add(job)
+    return job
+
+def claim(session: Session, worker_id: str, visibility_s: int | None = None) -> AnalyzeJob | None:
+    """
+    Toma el job disponible de mayor prioridad. El UPDATE condicional (status=queued)
+    hace de lock optimista: si otro worker lo tomó antes, rowcount=0 y se prueba el siguiente.
+    """
+    now = utcnow()
+    until = now + timedelta(seconds=visibility_s or settings.job_visibility_timeout_s)
+    ids = session.scalars(
+        select(AnalyzeJob.id)
+        .where(AnalyzeJob.status == JobStatus.queued, AnalyzeJob.available_at <= now)
+        .order_by(AnalyzeJob.priority.desc(), AnalyzeJob.id)
+        .limit(8)
+    ).all()
+    for job_id in ids:
+        res = session.execute(
+            update(AnalyzeJob)
+            .where(AnalyzeJob.id == job_id, AnalyzeJob.status == JobStatus.queued)
+            .values(status=JobStatus.running, locked_by=worker_id, locked_until=until,
+                    attempts=AnalyzeJob.attempts + 1, updated_at=now)
+        )
+        session.commit()
+        if res.rowcount == 1:
+            return session.get(AnalyzeJob, job_id)
+    return None
+
+def heartbeat(session: Session, job_id: int, worker_id: str, visibility_s: int | None = None) -> bool:
+    """Extiende el visibility timeout mientras el job sigue vivo; False si ya no es nuestro."""
+    until = utcnow() + timedelta(seconds=visibility_s or settings.job_visibility_timeout_s)
+    res = session.execute(
+        update(AnalyzeJob)
+        .where(AnalyzeJob.id == job_id, AnalyzeJob.locked_by == worker_id,
+               AnalyzeJob.status == JobStatus.running)
+        .values(locked_until=until)
+    )
+    session.commit()
+    return res.rowcount == 1
+
+def _owned(job_id: int, worker_id: str):
+    """UPDATE condicional: solo si el job sigue corriendo a nombre de este worker."""
+    return (update(AnalyzeJob)
+            .where(AnalyzeJob.id == job_id, AnalyzeJob.locked_by == worker_id,
+                   AnalyzeJob.status == JobStatus.running)
+            .execution_options(synchronize_session=False))
+
+def complete(session: Session, job_id: int, worker_id: str) -> bool:
+    """
+    Marca el job como hecho si todavía es nuestro (sin commit: va en la misma transacción
+    que el resultado). False si otro worker lo reclamó tras vencer el visibility timeout.
+    """
+    res = session.execute(_owned(job_id, worker_id).values(
+        status=JobStatus.done, locked_by=None, locked_until=None, updated_at=utcnow()))
+    return res.rowcount == 1
+
+def fail(session: Session, job: AnalyzeJob, worker_id: str, error: Exception | str) -> bool:
+    """
+    Reencola con backoff exponencial; True si ya no quedan intentos (fallo definitivo).
+    Si el job ya no es nuestro no toca nada y retorna False.
+    """
+    now = utcnow()
+    values = {"last_error": str(error)[:2000], "locked_by": None, "locked_until": None, "updated_at": now}
+    if job.attempts >= job.max_attempts:
+        values["status"] = JobStatus.failed
+    else:
+        values.update(status=JobStatus.queued, available_at=now + timedelta(seconds=2 ** job.attempts * 5))
+    res = session.execute(_owned(job.id, worker_id).values(**values))
+    session.commit()
+    return res.rowcount == 1 and values["status"] == JobStatus.failed
+
+def reap_stuck(session: Session) -> list[int]:
+    """
+    Jobs "running" cuyo visibility timeout venció (worker muerto): se reencolan,
+    o se dan por fallidos si agotaron sus intentos. Retorna los analysis_id fallidos.
+    """
+    now = utcnow()
+    failed = []
+    stuck = session.scalars(
+        select(AnalyzeJob).where(AnalyzeJob.status == JobStatus.running, AnalyzeJob.locked_until < now)
+    ).all()
+    for job in stuck:
+        job.last_error = f"visibility timeout (worker {job.locked_by})"
+        job.locked_by, job.locked_until, job.updated_at = None, None, now
+        if job.attempts >= job.max_attempts:
+            job.status = JobStatus.failed
+            failed.append(job.analysis_id)
+        else:
+            job.status = JobStatus.queued
+            job.available_at = now
+    session.commit()
+    return failed
+
+def recover_orphans(session: Session, older_than_s: int | None = None) -> int:
+    """
+    Filas AnalyzeResult en "running" sin job (p. ej. creadas por BackgroundTasks antes de
+    un reinicio): se encolan para reintentarlas.
+    """
+    # created_at lo pone la BD (func.now()): el límite se calcula con el mismo reloj
+    limit = session.scalar(select(func.now())) - timedelta(seconds=older_than_s or settings.job_visibility_timeout_s)
+    has_job = select(AnalyzeJob.id).where(AnalyzeJob.analysis_id == AnalyzeResult.id).exists()
+    rows = session.execute(
+        select(AnalyzeResult.id, AnalyzeResult.params_json)
+        .where(AnalyzeResult.status == AnalyzeStatus.running,
+               or_(AnalyzeResult.created_at < limit, AnalyzeResult.created_at.is_(None)),
+               ~has_job)
+    ).all()
+    for analysis_id, params in rows:
+        enqueue(session, analysis_id, kind="batch" if params and "items" in params else "single")
+    session.commit()
+    return len(rows)
@@ -0,0 +1,138 @@
+# app/jobs/worker.py
+"""
+Pool de workers de análisis, separado del proceso web:
+
+    python -m app.jobs.worker --concurrency 4
+
+Cada proceso hijo consume la cola (app.jobs.queue) de a un job a la vez.
+"""
+from __future__ import annotations
+import argparse
+import logging
+import multiprocessing as mp
+import os
+import signal
+import socket
+import threading
+from time import perf_counter
+
+from app.config import settings
+from app.db import SessionLocal
+from app.jobs import queue
+from app.models import AnalyzeJob, AnalyzeResult
+from app.services.analyze_results import save_result
+
+log = logging.getLogger("app.jobs.worker")
+
+def execute(params: dict) -> dict:
+    """Ejecuta el análisis descrito por params_json (mismo formato que AnalyzeReq / AnalyzeBatchReq)."""
+    from app.services.analyze_service import AnalyzeService
+    svc = AnalyzeService()
+    if "items" in params:
+        items = [(it["latitude"], it["longitude"], it["month"], it["day"]) for it in params["items"]]
+        return svc.run_batch(items, params["start_year"], params["end_year"],
+                             params["half_window_days"], params["factors"])
+    return svc.run(
+        lat=params["latitude"], lon=params["longitude"],
+        month=params["month"], day=params["day"],
+        start_year=params["start_year"], end_year=params["end_year"],
+        half_window_days=params["half_window_days"],
+        factors=params["factors"],
+    )
+
+def _heartbeat(job_id: int, worker_id: str, stop: threading.Event, lost: threading.Event) -> None:
+    every = max(1.0, settings.job_visibility_timeout_s / 3)
+    while not stop.wait(every):
+        with SessionLocal() as s:
+            if not queue.heartbeat(s, job_id, worker_id):
+                lost.set()  # otro worker lo reclamó: este resultado no se guarda
+                return
+
+def process_one(worker_id: str) -> bool:
+    """Reclama y ejecuta un job; False si la cola está vacía."""
+    with SessionLocal() as s:
+        for analysis_id in queue.reap_stuck(s):
+            save_result(s, analysis_id, None, "job abandonado: visibility timeout agotado")
+        job = queue.claim(s, worker_id)
+        if job is None:
+            return False
+        row = s.get(AnalyzeResult, job.analysis_id)
+        params = row.params_json if row else None
+        job_id = job.id
+
+    stop, lost = threading.Event(), threading.Event()
+    hb = threading.Thread(target=_heartbeat, args=(job_id, worker_id, stop, lost), daemon=True)
+    hb.start()
+    t0 = perf_counter()
+    try:
+        result, error = (execute(params), None) if params else (None, "análisis sin parámetros")
+    except Exception as e:  # el error se guarda en el job / la fila
+        result, error = None, e
+    finally:
+        stop.set()
+        hb.join()
+
+    if lost.is_set():
+        log.warning("job %s: se perdió el lock durante la ejecución, se descarta el resultado", job_id)
+        return True
+    with SessionLocal() as s:
+        job = s.get(AnalyzeJob, job_id)
+        if error is None:
+            # complete condicional + resultado en un solo commit (el de save_result)
+            if queue.complete(s, job_id, worker_id):
+                save_result(s, job.analysis_id, result, duration_ms=int((perf_counter() - t0) * 1000))
+            else:
+                s.rollback()
+                log.warning("job %s ya no es de %s: se descarta el resultado", job_id, worker_id)
+        else:
+            log.warning("job %s falló (intento %s/%s): %s", job_id, job.attempts, job.max_attempts, error)
+            if queue.fail(s, job, worker_id, error):
+                save_result(s, job.analysis_id, None, error)
+    return True
+
+def run_loop(worker_id: str, stop) -> None:
+    while not stop.is_set():
+        try:
+            busy = process_one(worker_id)
+        except Exception:
+            log.exception("error en el worker %s", worker_id)
+            busy = False
+        if not busy:
+            stop.wait(settings.job_poll_interval_s)
+
+def _child(index: int, stop) -> None:
+    for sig in (signal.SIGINT, signal.SIGTERM):  # el padre coordina el apagado
+        signal.signal(sig, signal.SIG_IGN)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(message)s")
+    run_loop(f"{socket.gethostname()}:{os.getpid()}:{index}", stop)
+
+def main(argv=None) -> None:
+    ap = argparse.ArgumentParser(description="Workers de la cola de análisis")
+    ap.add_argument("--concurrency", type=int, default=settings.job_workers)
+    args = ap.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(message)s")
+
+    from app.db import engine, init_schema
+    init_schema(engine)
+    with SessionLocal() as s:
+        n = queue.recover_orphans(s)
+        if n:
+            log.info("%s análisis huérfanos reencolados", n)
+
+    ctx = mp.get_context("spawn")  # procesos limpios: sin conexiones heredadas del padre
+    stop = ctx.Event()
+    procs = [ctx.Process(target=_child, args=(i, stop), name=f"analyze-worker-{i}")
+             for i in range(max(1, args.concurrency))]
+    for p in procs:
+        p.start()
+
+    def _shutdown(*_):
+        log.info("apagando workers (se termina el job en curso)…")
+        stop.set()
+    signal.signal(signal.SIGTERM, _shutdown)
+    signal.signal(signal.SIGINT, _shutdown)
+    for p in procs:
+        p.join()
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,17 @@
 # app/main.py
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
 from app.config import settings
 from app.routers import health, analyze, metadata, series
 from app.routers import auth, docs_test  # ⬅️ agrega estos
+from app.utils.http import aclose_clients
+from app.rate_limit import RateLimitMiddleware
+from app.services.plots import shutdown_pool as shutdown_plot_pool
+from app.services.passwords import shutdown_pool as shutdown_password_pool
+from app.services.audit import login_events
+from app.services import refresh_tokens
 
 # --- Sub-API que vivirá bajo /api ---
 api = FastAPI(
@@ -32,6 +39,9 @@ def custom_openapi():
 
 api.openapi = custom_openapi
 
+# presupuestos por ruta (auth, analyze, series); ver RATE_LIMIT_* en config
+api.add_middleware(RateLimitMiddleware)
+
 
 # Routers dentro de la sub-API
 api.include_router(health.router)                   # GET  /api/health
@@ -44,7 +54,18 @@ api.include_router(auth.router)       # tiene prefix="/v1/auth" adentro
 api.include_router(docs_test.router)  # tiene prefix="/v1/test" adentro
 
 # --- App raíz (solo contenedor de la sub-API) ---
-app = FastAPI()
+# (el lifespan vive aquí: Starlette no lo propaga a las apps montadas)
+@asynccontextmanager
+async def lifespan(_: FastAPI):
+    refresh_tokens.start()  # set de refresh tokens revocados + purga de vencidos
+    yield
+    refresh_tokens.stop()
+    await aclose_clients()  # cierra los pools httpx compartidos
+    shutdown_plot_pool()
+    shutdown_password_pool()
+    login_events.close()  # escribe los LoginEvent pendientes
+
+app = FastAPI(lifespan=lifespan)
 
 if settings.cors_enabled:
     app.add_middleware(
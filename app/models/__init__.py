@@ -5,6 +5,7 @@ from .user_role import UserRole
 from .refresh_token import RefreshToken
 from .login_event import LoginEvent
 from .analyze_result import AnalyzeResult, AnalyzeStatus  # ⬅️ nuevo
+from .analyze_job import AnalyzeJob, JobStatus
 
 
 __all__ = ["Base", "User", "Role", "UserRole", "RefreshToken", "LoginEvent"]
@@ -0,0 +1,33 @@
+# app/models/analyze_job.py
+from datetime import datetime
+from sqlalchemy import Integer, String, DateTime, ForeignKey, Enum, Text, Index
+from sqlalchemy.orm import Mapped, mapped_column
+from app.db import Base
+import enum
+
+class JobStatus(str, enum.Enum):
+    queued = "queued"
+    running = "running"
+    done = "done"
+    failed = "failed"
+
+class AnalyzeJob(Base):
+    """Cola persistente de análisis (la consumen los workers de app.jobs.worker)."""
+    __tablename__ = "analyze_jobs"
+    __table_args__ = (Index("ix_analyze_jobs_claim", "status", "priority", "available_at"),)
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    analysis_id: Mapped[int] = mapped_column(ForeignKey("analyze_results.id"), index=True)
+    kind: Mapped[str] = mapped_column(String(16), default="single")  # single | batch
+    priority: Mapped[int] = mapped_column(Integer, default=0)        # mayor = antes
+    status: Mapped[JobStatus] = mapped_column(Enum(JobStatus), default=JobStatus.queued)
+    attempts: Mapped[int] = mapped_column(Integer, default=0)
+    max_attempts: Mapped[int] = mapped_column(Integer, default=3)
+
+    # UTC sin zona (comparaciones portables MySQL/SQLite)
+    available_at: Mapped[datetime] = mapped_column(DateTime)
+    locked_by: Mapped[str | None] = mapped_column(String(64))
+    locked_until: Mapped[datetime | None] = mapped_column(DateTime)  # visibility timeout
+    last_error: Mapped[str | None] = mapped_column(Text)
+    created_at: Mapped[datetime] = mapped_column(DateTime)
+    updated_at: Mapped[datetime | None] = mapped_column(DateTime)
@@ -1,5 +1,6 @@
 # app/models/analyze_result.py
-from sqlalchemy import Integer, String, DateTime, ForeignKey, JSON, Enum
+from sqlalchemy import Integer, String, DateTime, ForeignKey, JSON, Enum, Index
+from sqlalchemy.dialects import sqlite
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 from sqlalchemy.sql import func
 from app.db import Base
@@ -10,19 +11,27 @@ class AnalyzeStatus(str, enum.Enum):
     error = "error"
     running = "running"
 
+_SQLITE_TS = "%(year)04d-%(month)02d-%(day)02d %(hour)02d:%(minute)02d:%(second)02d"
+
 class AnalyzeResult(Base):
     __tablename__ = "analyze_results"
+    # historial por usuario (keyset sobre created_at, id)
+    __table_args__ = (Index("ix_analyze_results_user_created", "user_id", "created_at", "id"),)
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
     user_id: Mapped[int] = mapped_column(ForeignKey("users.id"), index=True)
     status: Mapped[AnalyzeStatus] = mapped_column(Enum(AnalyzeStatus), default=AnalyzeStatus.ok)
-    created_at: Mapped["DateTime"] = mapped_column(DateTime, server_default=func.now())
+    # en SQLite, mismo formato que CURRENT_TIMESTAMP: el cursor del historial compara por igualdad
+    created_at: Mapped["DateTime"] = mapped_column(
+        DateTime().with_variant(sqlite.DATETIME(storage_format=_SQLITE_TS), "sqlite"),
+        server_default=func.now())
     duration_ms: Mapped[int | None] = mapped_column(Integer)
 
     params_json: Mapped[dict | None] = mapped_column(JSON)
     result_json: Mapped[dict | None] = mapped_column(JSON)
     result_uri: Mapped[str | None] = mapped_column(String(512))
     result_hash: Mapped[str | None] = mapped_column(String(64))
+    params_hash: Mapped[str | None] = mapped_column(String(64), index=True)  # parámetros normalizados (reutilización)
 
     model_version: Mapped[str | None] = mapped_column(String(64))
     dataset_version: Mapped[str | None] = mapped_column(String(64))
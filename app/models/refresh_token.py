@@ -1,4 +1,5 @@
-from sqlalchemy import String, DateTime, Boolean, ForeignKey
+from typing import Optional
+from sqlalchemy import BINARY, DateTime, Boolean, ForeignKey
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 from datetime import datetime, timezone
 from app.db import Base
@@ -8,8 +9,9 @@ class RefreshToken(Base):
 
     id: Mapped[int] = mapped_column(primary_key=True)
     user_id: Mapped[int] = mapped_column(ForeignKey("users.id"), index=True)
-    token: Mapped[str] = mapped_column(String(512), unique=True, index=True)
+    token_hash: Mapped[bytes] = mapped_column(BINARY(32), unique=True)  # sha256 del JWT (índice de 32 bytes)
     created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=lambda: datetime.now(timezone.utc))
+    expires_at: Mapped[Optional[datetime]] = mapped_column(DateTime(timezone=True), index=True, nullable=True)
     revoked: Mapped[bool] = mapped_column(Boolean, default=False)
 
     user = relationship("User", back_populates="refresh_tokens")
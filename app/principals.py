@@ -0,0 +1,87 @@
+# app/principals.py
+from __future__ import annotations
+from dataclasses import dataclass
+from typing import Optional
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session, selectinload
+
+from app.config import settings
+from app.models import User, UserRole
+from app.utils.cache import LRUCache
+
+@dataclass(frozen=True)
+class Principal:
+    """Usuario autenticado tal como lo ven los endpoints: sin sesión ni lazy-loads."""
+    id: int
+    email: str
+    roles: tuple[str, ...] = ()
+
+    def has_any_role(self, required: set[str]) -> bool:
+        return not required.isdisjoint(r.lower() for r in self.roles)
+
+# uid → Principal resuelto; _stale: uids invalidados (sus claims ya no son confiables)
+_STALE = object()
+_cache = LRUCache(settings.auth_principal_cache_size, ttl=settings.auth_principal_ttl_s)
+# las marcas de invalidación viven lo que un access token: después ya no hay claims viejos en juego
+_stale = LRUCache(settings.auth_principal_cache_size, ttl=settings.access_min * 60)
+
+def from_user(user: User) -> Principal:
+    return Principal(id=user.id, email=user.email, roles=tuple(r.name for r in (user.roles or [])))
+
+def _load(db: Session, uid: Optional[int], email: str) -> Optional[Principal]:
+    q = db.query(User).options(selectinload(User.roles)).filter(User.is_active == True)
+    user = (q.filter(User.id == uid) if uid is not None else q.filter(User.email == email)).first()
+    if user is None or user.email != email:
+        return None
+    return from_user(user)
+
+def resolve(payload: dict, db: Session) -> Optional[Principal]:
+    """
+    Principal de un access token ya verificado (firma y exp).
+    AUTH_DB_CHECK:
+      never  → confía en los claims (uid, sub, roles) durante la vida del token;
+      miss   → verifica en BD una vez por usuario cada AUTH_PRINCIPAL_TTL_S (por defecto);
+      always → consulta la BD en cada request (comportamiento anterior).
+    Tokens sin `uid` (emitidos antes) y usuarios invalidados siempre pasan por BD.
+    """
+    email = payload.get("sub")
+    uid = payload.get("uid")
+    if settings.auth_db_check == "never" and uid is not None and _stale.get(uid) is None:
+        principal = _cache.get(uid)
+        if principal is None or principal.email != email:
+            principal = Principal(id=int(uid), email=email, roles=tuple(payload.get("roles") or ()))
+            _cache.put(uid, principal)
+        return principal
+    return lookup(db, uid, email)
+
+def lookup(db: Session, uid: Optional[int], email: str) -> Optional[Principal]:
+    """Principal desde la caché o la BD, nunca desde claims (p. ej. al canjear un refresh token)."""
+    cacheable = uid is not None and settings.auth_db_check != "always"
+    if cacheable:
+        principal = _cache.get(uid)
+        if principal is not None and principal.email == email:
+            return principal
+    principal = _load(db, uid, email)
+    if principal is not None and cacheable:
+        _cache.put(uid, principal)
+    return principal
+
+def invalidate(user_id: int) -> None:
+    """Baja, desactivación o cambio de roles: el próximo request de ese usuario revalida en BD."""
+    _cache.pop(user_id)
+    _stale.put(user_id, _STALE)
+
+def clear() -> None:
+    _cache.clear()
+    _stale.clear()
+
+@event.listens_for(Session, "after_flush")
+def _invalidate_on_change(session: Session, _ctx) -> None:
+    # cualquier cambio de User (is_active, roles vía relationship, email…) o de user_roles
+    for obj in (*session.dirty, *session.deleted):
+        if isinstance(obj, User) and obj.id is not None:
+            invalidate(obj.id)
+    for obj in (*session.new, *session.deleted):
+        if isinstance(obj, UserRole):
+            invalidate(obj.user_id)
@@ -1,28 +1,228 @@
 # app/rate_limit.py
-from time import time
-from collections import defaultdict
-from typing import Tuple
+from __future__ import annotations
+import logging
+import math
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Optional, Protocol, Tuple
 
-# Ventana deslizante simple en memoria (por proceso)
-# En producción usa Redis (slowapi/limits) para multi-worker.
-WINDOW_SEC = 60
-MAX_ATTEMPTS = 10  # p. ej., 10 intentos/min por IP
+from starlette.concurrency import run_in_threadpool
 
-_attempts: dict[str, list[float]] = defaultdict(list)
+from app.config import settings
+
+log = logging.getLogger("app.rate_limit")
+
+# GCRA (generic cell rate algorithm): por clave solo se guarda el TAT (theoretical arrival time),
+# un float. Con `rate` requests cada `period` s y ráfaga `burst`:
+#   T = period / rate;  tat' = max(tat, now) + T;  permitido si tat' - burst*T <= now
+# Una clave con tat <= now equivale a una clave nueva → se puede desalojar sin perder nada.
+
+class Backend(Protocol):
+    """
+    Almacén de TATs. `gcra` debe ser atómico entre todos los procesos que lo comparten.
+    Un backend Redis implementaría lo mismo con un script EVAL (GET/SET PX sobre la clave).
+    """
+    def gcra(self, key: str, interval: float, burst: int, now: float) -> Tuple[bool, float]: ...
+
+def _step(tat: Optional[float], interval: float, burst: int, now: float) -> Tuple[bool, float, float]:
+    """(permitido, segundos para reintentar, nuevo tat)."""
+    new_tat = max(tat or now, now) + interval
+    allow_at = new_tat - burst * interval
+    if allow_at > now:
+        return False, allow_at - now, tat or now
+    return True, 0.0, new_tat
+
+class MemoryBackend:
+    """Por proceso (un solo worker / tests). Desaloja claves inactivas y, si no alcanza, las más viejas."""
+
+    blocking = False  # microsegundos, sin I/O: se llama directo desde el event loop
+
+    def __init__(self, max_keys: int = 100_000):
+        self.max_keys = max_keys
+        self._lock = threading.Lock()
+        self._tat: "OrderedDict[str, float]" = OrderedDict()  # orden = última actualización
+
+    def gcra(self, key: str, interval: float, burst: int, now: float) -> Tuple[bool, float]:
+        with self._lock:
+            ok, retry, tat = _step(self._tat.get(key), interval, burst, now)
+            if ok:
+                self._tat[key] = tat
+                self._tat.move_to_end(key)
+                self._evict(now)
+            return ok, retry
+
+    def _evict(self, now: float) -> None:
+        data = self._tat
+        while data:
+            key, tat = next(iter(data.items()))
+            if tat > now and len(data) <= self.max_keys:
+                break
+            del data[key]
+
+class SQLiteBackend:
+    """
+    Compartido entre workers de uvicorn de la misma máquina: un archivo SQLite en WAL
+    con una fila (clave, tat) por cliente. Las claves inactivas se borran en lote.
+    """
+
+    SWEEP_EVERY = 1000
+    blocking = True  # I/O + lock de escritura: se llama desde el threadpool
+
+    def __init__(self, path: str, timeout: float = 0.05):
+        self.path = path
+        self.timeout = timeout  # espera máx. por el lock; vencida → OperationalError (el limiter deja pasar)
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._local = threading.local()
+        self._ops = 0
+        with self._conn() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS gcra (key TEXT PRIMARY KEY, tat REAL NOT NULL) WITHOUT ROWID")
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=OFF")  # estado efímero: perderlo en un crash solo reinicia cuotas
+            self._local.conn = conn
+        return conn
+
+    def gcra(self, key: str, interval: float, burst: int, now: float) -> Tuple[bool, float]:
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")  # OperationalError si no obtiene el lock en `timeout`
+        try:
+            row = conn.execute("SELECT tat FROM gcra WHERE key = ?", (key,)).fetchone()
+            ok, retry, tat = _step(row[0] if row else None, interval, burst, now)
+            if ok:
+                conn.execute("INSERT INTO gcra (key, tat) VALUES (?, ?) "
+                             "ON CONFLICT(key) DO UPDATE SET tat = excluded.tat", (key, tat))
+            self._ops += 1
+            if self._ops % self.SWEEP_EVERY == 0:
+                conn.execute("DELETE FROM gcra WHERE tat <= ?", (now,))
+            conn.execute("COMMIT")
+        except BaseException:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        return ok, retry
+
+class Budget:
+    """`rate` requests cada `period` segundos, con ráfaga de hasta `rate` seguidas."""
+
+    def __init__(self, name: str, rate: int, period: float):
+        self.name = name
+        self.rate = rate
+        self.interval = period / rate
+
+    @classmethod
+    def parse(cls, name: str, spec: str) -> Optional["Budget"]:
+        """'N/S' → N requests cada S segundos; vacío o '0' → sin límite."""
+        spec = (spec or "").strip()
+        if not spec or spec == "0":
+            return None
+        rate, _, period = spec.partition("/")
+        return cls(name, int(rate), float(period or 60))
+
+class RateLimiter:
+    def __init__(self, backend: Backend):
+        self.backend = backend
+        self.errors = 0  # decisiones que fallaron en el backend (se dejaron pasar)
+
+    def hit(self, budget: Budget, client: str) -> Tuple[bool, float]:
+        """(permitido, segundos para reintentar). Si el backend falla (p. ej. SQLite bloqueado), deja pasar."""
+        try:
+            return self.backend.gcra(f"{budget.name}:{client}", budget.interval, budget.rate, time.time())
+        except sqlite3.OperationalError as e:
+            self.errors += 1
+            if self.errors % 100 == 1:  # no inundar el log bajo contención sostenida
+                log.warning("rate limit sin decisión (%s fallos, se deja pasar): %s", self.errors, e)
+            return True, 0.0
+
+    async def hit_async(self, budget: Budget, client: str) -> Tuple[bool, float]:
+        if getattr(self.backend, "blocking", True):
+            return await run_in_threadpool(self.hit, budget, client)
+        return self.hit(budget, client)
+
+def _make_backend() -> Backend:
+    if settings.rate_limit_backend == "sqlite":
+        return SQLiteBackend(settings.rate_limit_sqlite_path, settings.rate_limit_sqlite_timeout_ms / 1000)
+    return MemoryBackend(settings.rate_limit_max_keys)
+
+_limiter: Optional[RateLimiter] = None
+_limiter_lock = threading.Lock()
+
+def get_limiter() -> RateLimiter:
+    global _limiter
+    with _limiter_lock:
+        if _limiter is None:
+            _limiter = RateLimiter(_make_backend())
+        return _limiter
+
+# (métodos, prefijo de ruta dentro de /api, presupuesto); gana la primera regla que coincide
+def _rules() -> list[tuple[Optional[set[str]], str, Budget]]:
+    specs = [
+        ({"POST"}, "/v1/auth/token", "auth", settings.rate_limit_auth),
+        ({"POST"}, "/v1/auth/register", "auth", settings.rate_limit_auth),
+        ({"POST"}, "/v1/auth/refresh", "auth-refresh", settings.rate_limit_auth_refresh),
+        ({"POST"}, "/v1/analyze", "analyze", settings.rate_limit_analyze),
+        ({"GET", "HEAD"}, "/v1/analyze", "analyze-read", settings.rate_limit_analyze_read),
+        (None, "/v1/series", "series", settings.rate_limit_series),
+    ]
+    out = []
+    for methods, prefix, name, spec in specs:
+        budget = Budget.parse(name, spec)
+        if budget is not None:
+            out.append((methods, prefix, budget))
+    return out
+
+class RateLimitMiddleware:
+    """
+    Middleware ASGI (no BaseHTTPMiddleware: no interfiere con SSE ni con respuestas en streaming).
+    Clave por IP del cliente; responde 429 con Retry-After al agotar el presupuesto de la ruta.
+    """
+
+    def __init__(self, app, limiter: Optional[RateLimiter] = None):
+        self.app = app
+        self.limiter = limiter
+        self.rules = _rules()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not settings.rate_limit_enabled:
+            return await self.app(scope, receive, send)
+        budget = self._match(scope)
+        if budget is not None:
+            client = scope["client"][0] if scope.get("client") else "unknown"
+            limiter = self.limiter or get_limiter()
+            ok, retry = await limiter.hit_async(budget, client)
+            if not ok:
+                return await self._reject(send, retry)
+        await self.app(scope, receive, send)
+
+    def _match(self, scope) -> Optional[Budget]:
+        path, root = scope["path"], scope.get("root_path", "")
+        if root and path.startswith(root):
+            path = path[len(root):]
+        for methods, prefix, budget in self.rules:
+            if (methods is None or scope["method"] in methods) and path.startswith(prefix):
+                return budget
+        return None
+
+    @staticmethod
+    async def _reject(send, retry: float) -> None:
+        body = b'{"detail":"Rate limit alcanzado"}'
+        await send({"type": "http.response.start", "status": 429, "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode()),
+            (b"retry-after", str(max(1, math.ceil(retry))).encode()),
+        ]})
+        await send({"type": "http.response.body", "body": body})
 
 def check_and_count(ip: str) -> Tuple[bool, int]:
-    now = time()
-    bucket = _attempts[ip]
-    # limpia intentos viejos
-    i = 0
-    while i < len(bucket) and now - bucket[i] > WINDOW_SEC:
-        i += 1
-    if i:
-        del bucket[:i]
-    # verifica límite
-    if len(bucket) >= MAX_ATTEMPTS:
-        # retorna False y segundos restantes (aprox)
-        ttl = WINDOW_SEC - int(now - bucket[0])
-        return False, max(ttl, 1)
-    bucket.append(now)
-    return True, 0
+    """Compatibilidad: presupuesto de login por IP → (permitido, segundos para reintentar)."""
+    budget = Budget.parse("auth", settings.rate_limit_auth)
+    if budget is None:
+        return True, 0
+    ok, retry = get_limiter().hit(budget, ip)
+    return ok, 0 if ok else max(1, math.ceil(retry))
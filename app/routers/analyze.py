@@ -1,107 +1,174 @@
 # app/routers/analyze.py
-from fastapi import APIRouter, HTTPException, Depends, BackgroundTasks, Query, Request
+from fastapi import APIRouter, HTTPException, Depends, BackgroundTasks, Query, Request, Response
+from fastapi.responses import StreamingResponse
+from sqlalchemy import and_, func, or_
 from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
 from time import perf_counter
-import hashlib, json
+from typing import AsyncIterator, Awaitable, Callable
+from datetime import datetime
+import asyncio, base64, json
 
-from app.schemas.analyze_req import AnalyzeReq
+from app.schemas.analyze_req import AnalyzeReq, AnalyzeBatchReq
 from app.schemas.analyze_resp import (
     AnalyzeCreateOut, AnalyzeResultOut, AnalyzeHistoryOut, AnalyzeHistoryItem
 )
 from app.services.analyze_service import AnalyzeService
-from app.deps import get_db, get_current_user
-from app.models import AnalyzeResult, AnalyzeStatus, User
-from app.db import Base, engine
+from app.deps import get_db, get_current_user, get_current_user_stream
+from app.models import AnalyzeResult, AnalyzeStatus
+from app.principals import Principal
+from app.db import engine, init_schema
+from app.config import settings
+from app.jobs import queue
+from app.services.analyze_results import (
+    save_result, store_result, load_result, params_hash, find_reusable, adapt_result, result_columns,
+)
+from app.services.result_store import store as blobs
+from app.utils import encoders
+from app.utils.http_cache import IMMUTABLE, etag_for, matches, not_modified, set_validators
+from app.services.analyze_events import broker, progress_callback, TERMINAL
+from app.db import SessionLocal
 
 router = APIRouter(tags=["analyze"])
 svc = AnalyzeService()
 
-# crea tablas si no existen (demo; en prod usa Alembic)
-Base.metadata.create_all(bind=engine)
+# crea tablas si no existen y agrega columnas nuevas a las existentes (demo; en prod usa Alembic)
+init_schema(engine)
 
-def _sha256(d: dict) -> str:
-    return hashlib.sha256(json.dumps(d, sort_keys=True, separators=(",", ":")).encode()).hexdigest()
+def _save_result(analysis_id: int, t0: float, result: dict | None, error: Exception | None = None):
+    session = get_db().__next__()  # nueva sesión para el hilo de background
+    try:
+        save_result(session, analysis_id, result, error, duration_ms=int((perf_counter() - t0) * 1000))
+    finally:
+        session.close()
 
-@router.post("/analyze", response_model=AnalyzeCreateOut, summary="Ejecuta análisis y lo guarda")
-def analyze(req: AnalyzeReq,
-            bt: BackgroundTasks,
-            request: Request,
-            db: Session = Depends(get_db),
-            user: User = Depends(get_current_user)):
-    # 1) Pre-crear fila "running"
-    t0 = perf_counter()
+async def _run_analysis(analysis_id: int, t0: float, work: Callable[[], Awaitable[dict]]):
+    # la descarga es async; solo la escritura en BD pasa por el threadpool
+    try:
+        result = await work()
+        await run_in_threadpool(_save_result, analysis_id, t0, result)
+    except Exception as e:
+        await run_in_threadpool(_save_result, analysis_id, t0, None, e)
+
+def _create_row(db: Session, user: Principal, request: Request, params: dict, kind: str = "single") -> AnalyzeResult:
+    """
+    Fila del análisis. Si ya existe un resultado con los mismos parámetros normalizados
+    se responde al instante (status ok); si no, queda "running" y, con la cola activa,
+    el job se encola en la misma transacción.
+    """
     row = AnalyzeResult(
         user_id=user.id,
         status=AnalyzeStatus.running,
-        params_json=req.model_dump(),
-        model_version="v1",
-        dataset_version="POWER-2024",
+        params_json=params,
+        model_version=settings.model_version,
+        dataset_version=settings.dataset_version,
         request_id=request.headers.get("X-Request-ID"),
     )
+    row.params_hash = params_hash(params, row.dataset_version, row.model_version)
+    cached = (find_reusable(db, row.params_hash, row.dataset_version, row.model_version)
+              if settings.analyze_reuse_enabled else None)
+    if cached is not None:
+        row.status = AnalyzeStatus.ok
+        store_result(row, adapt_result(cached, params))
+        row.duration_ms = 0
+        row.response_status = 200
     db.add(row)
+    if settings.analyze_queue_enabled and cached is None:
+        db.flush()
+        queue.enqueue(db, row.id, kind=kind)
     db.commit()
     db.refresh(row)
+    return row
+
+@router.post("/analyze", response_model=AnalyzeCreateOut, summary="Ejecuta análisis y lo guarda")
+def analyze(req: AnalyzeReq,
+            bt: BackgroundTasks,
+            request: Request,
+            db: Session = Depends(get_db),
+            user: Principal = Depends(get_current_user)):
+    # 1) Pre-crear fila "running"
+    t0 = perf_counter()
+    row = _create_row(db, user, request, req.model_dump())
+    if row.status != AnalyzeStatus.running or settings.analyze_queue_enabled:  # reutilizado / lo ejecuta el pool de workers
+        return {"analysis_id": row.id, "status": "ok"}
 
     # 2) Ejecutar en background y guardar resultado
-    def do_work(analysis_id: int, payload: AnalyzeReq):
-        session = get_db().__next__()  # nueva sesión para el hilo de background
-        try:
-            result = svc.run(
-                lat=payload.latitude, lon=payload.longitude,
-                month=payload.month, day=payload.day,
-                start_year=payload.start_year, end_year=payload.end_year,
-                half_window_days=payload.half_window_days,
-                factors=payload.factors
-            )
-            dur_ms = int((perf_counter() - t0) * 1000)
-            row2 = session.get(AnalyzeResult, analysis_id)
-            row2.status = AnalyzeStatus.ok
-            row2.result_json = result
-            row2.result_hash = _sha256(result)
-            row2.duration_ms = dur_ms
-            row2.response_status = 200
-            session.commit()
-        except Exception as e:
-            row2 = session.get(AnalyzeResult, analysis_id)
-            row2.status = AnalyzeStatus.error
-            row2.result_json = {"error": str(e)}
-            row2.response_status = 500
-            session.commit()
-        finally:
-            session.close()
-
-    bt.add_task(do_work, row.id, req)
+    bt.add_task(_run_analysis, row.id, t0, lambda: svc.run_async(
+        lat=req.latitude, lon=req.longitude,
+        month=req.month, day=req.day,
+        start_year=req.start_year, end_year=req.end_year,
+        half_window_days=req.half_window_days,
+        factors=req.factors,
+        progress=progress_callback(row.id),
+    ))
 
     return {"analysis_id": row.id, "status": "ok"}
 
-@router.get("/analyze/{analysis_id}", response_model=AnalyzeResultOut, summary="Detalle de un análisis")
-def get_analysis(analysis_id: int,
-                db: Session = Depends(get_db),
-                user: User = Depends(get_current_user)):
-    row = db.get(AnalyzeResult, analysis_id)
-    if not row or row.user_id != user.id:
-        raise HTTPException(status_code=404, detail="No encontrado")
-    return {
-        "id": row.id,
-        "status": row.status.value,
-        "created_at": row.created_at.isoformat(),
-        "params_json": row.params_json,
-        "result_json": row.result_json,
-        "result_uri": row.result_uri
-    }
+@router.post("/analyze/batch", response_model=AnalyzeCreateOut,
+             summary="Análisis por lote (muchas ubicaciones/fechas en un solo trabajo)")
+def analyze_batch(req: AnalyzeBatchReq,
+                  bt: BackgroundTasks,
+                  request: Request,
+                  db: Session = Depends(get_db),
+                  user: Principal = Depends(get_current_user)):
+    """
+    Agrupa los items por celda de la malla: una descarga por celda y las estadísticas
+    de todas sus fechas en bloque. El resultado (`result_json.items`) sigue el orden de entrada.
+    """
+    t0 = perf_counter()
+    row = _create_row(db, user, request, req.model_dump(), kind="batch")
+    if row.status != AnalyzeStatus.running or settings.analyze_queue_enabled:
+        return {"analysis_id": row.id, "status": "ok"}
+    items = [(it.latitude, it.longitude, it.month, it.day) for it in req.items]
+    bt.add_task(_run_analysis, row.id, t0, lambda: svc.run_batch_async(
+        items, req.start_year, req.end_year, req.half_window_days, req.factors,
+        progress=progress_callback(row.id),
+    ))
+    return {"analysis_id": row.id, "status": "ok"}
 
+def _encode_cursor(created_at, id_: int) -> str:
+    raw = json.dumps([created_at.isoformat(), id_], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def _decode_cursor(cursor: str) -> tuple[datetime, int]:
+    try:
+        created_at, id_ = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        return datetime.fromisoformat(created_at), int(id_)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Cursor inválido")
+
+# (declarada antes de /analyze/{analysis_id}: si no, "history" se valida como id → 422)
 @router.get("/analyze/history", response_model=AnalyzeHistoryOut, summary="Historial del usuario (paginado)")
 def history_list(page: int = Query(1, ge=1),
                 page_size: int = Query(20, ge=1, le=100),
+                cursor: str | None = Query(None, description="next_cursor de la página anterior (keyset)"),
+                include_total: bool = Query(False, description="Conteo exacto (costoso con mucho historial)"),
                 db: Session = Depends(get_db),
-                user: User = Depends(get_current_user)):
-    q = (db.query(AnalyzeResult)
+                user: Principal = Depends(get_current_user)):
+    """
+    Paginación por cursor sobre (created_at, id) con el índice (user_id, created_at, id):
+    cada página cuesta lo mismo sin importar la profundidad. `page` (OFFSET) se mantiene
+    por compatibilidad; `total` solo se calcula con include_total=true.
+    """
+    q = (db.query(AnalyzeResult.id, AnalyzeResult.status, AnalyzeResult.created_at, AnalyzeResult.result_uri)
         .filter(AnalyzeResult.user_id == user.id)
-        .order_by(AnalyzeResult.created_at.desc()))
-    total = q.count()
-    rows = q.offset((page - 1) * page_size).limit(page_size).all()
+        .order_by(AnalyzeResult.created_at.desc(), AnalyzeResult.id.desc()))
+    if cursor:
+        c_at, c_id = _decode_cursor(cursor)
+        # (created_at, id) < (c_at, c_id): el orden de created_at no tiene por qué seguir al id
+        q = q.filter(or_(AnalyzeResult.created_at < c_at,
+                         and_(AnalyzeResult.created_at == c_at, AnalyzeResult.id < c_id)))
+    elif page > 1:
+        q = q.offset((page - 1) * page_size)
+    rows = q.limit(page_size + 1).all()
+    more = len(rows) > page_size
+    rows = rows[:page_size]
+    total = None
+    if include_total:
+        total = db.query(func.count(AnalyzeResult.id)).filter(AnalyzeResult.user_id == user.id).scalar()
     return {
         "page": page, "page_size": page_size, "total": total,
+        "next_cursor": _encode_cursor(rows[-1].created_at, rows[-1].id) if more else None,
         "items": [
             AnalyzeHistoryItem(
                 id=r.id,
@@ -112,3 +179,122 @@ def history_list(page: int = Query(1, ge=1),
             for r in rows
         ]
     }
+
+@router.get("/analyze/{analysis_id}", response_model=AnalyzeResultOut, summary="Detalle de un análisis")
+def get_analysis(analysis_id: int,
+                request: Request,
+                response: Response,
+                db: Session = Depends(get_db),
+                user: Principal = Depends(get_current_user)):
+    """
+    Un análisis terminado no cambia: ETag por (id, result_hash) y caché privada inmutable.
+    Con If-None-Match vigente responde 304 leyendo solo columnas pequeñas.
+    """
+    head = (db.query(AnalyzeResult.user_id, AnalyzeResult.status, AnalyzeResult.result_hash)
+              .filter(AnalyzeResult.id == analysis_id).first())
+    if not head or head.user_id != user.id:
+        raise HTTPException(status_code=404, detail="No encontrado")
+    done = head.status != AnalyzeStatus.running
+    fmt = encoders.negotiate(request)
+    etag = etag_for("analysis", analysis_id, head.status.value, head.result_hash, fmt) if done else None
+    cache_control = f"private, {IMMUTABLE}" if done else "no-store"
+    if done and matches(request, etag):
+        return not_modified(etag, cache_control)
+
+    row = db.get(AnalyzeResult, analysis_id)
+    out = {
+        "id": row.id,
+        "status": row.status.value,
+        "created_at": row.created_at.isoformat(),
+        "params_json": row.params_json,
+        "result_json": row.result_json,
+        "result_uri": row.result_uri
+    }
+    blob = row.result_json is None and blobs.is_blob(row.result_uri)
+    if fmt != "json":
+        # formatos binarios (Accept / ?format=): MessagePack del documento, Arrow/Parquet aplanados
+        result = load_result(row.result_json, row.result_uri)
+        if fmt == "msgpack":
+            body = encoders.encode_object(fmt, {**out, "result_json": result})
+        else:
+            meta = {k: v for k, v in out.items() if k != "result_json"}
+            body = encoders.encode_columns(fmt, result_columns(result or {}), meta)
+        response = encoders.response(fmt, body)
+    elif blob:
+        response = StreamingResponse(_stream_with_blob(out), media_type="application/json")
+    else:
+        response.headers["Vary"] = "Accept"
+        response.headers["Cache-Control"] = cache_control
+        if done:
+            response.headers["ETag"] = etag
+        return out
+    return set_validators(response, etag, cache_control) if done else response
+
+def _stream_with_blob(out: dict):
+    """Misma forma que AnalyzeResultOut, con result_json copiado del blob en trozos (sin cargarlo entero)."""
+    head = json.dumps({k: v for k, v in out.items() if k != "result_json"}, separators=(",", ":"))
+    yield head[:-1].encode() + b',"result_json":'
+    yield from blobs.iter_bytes(out["result_uri"])
+    yield b"}"
+
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n"
+
+def _poll_status(analysis_id: int) -> tuple[str, dict | None]:
+    # solo la columna de estado; el resultado se lee una vez, al terminar
+    with SessionLocal() as s:
+        st = s.query(AnalyzeResult.status).filter(AnalyzeResult.id == analysis_id).scalar()
+        if st is None or st.value not in TERMINAL:
+            return (st.value if st else "error"), None
+        found = s.query(AnalyzeResult.result_json, AnalyzeResult.result_uri).filter(AnalyzeResult.id == analysis_id).one()
+        return st.value, load_result(*found)
+
+def _owner_of(analysis_id: int) -> int | None:
+    with SessionLocal() as s:
+        return s.query(AnalyzeResult.user_id).filter(AnalyzeResult.id == analysis_id).scalar()
+
+async def _event_stream(request: Request, analysis_id: int, q: asyncio.Queue) -> AsyncIterator[str]:
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + settings.analyze_events_timeout_s
+    try:
+        yield "retry: 3000\n\n"
+        # suscrito antes de leer el estado: no se pierde un "done" entre ambos pasos
+        status, result = await run_in_threadpool(_poll_status, analysis_id)
+        if status in TERMINAL:
+            yield _sse("done", {"analysis_id": analysis_id, "status": status, "result_json": result})
+            return
+        yield _sse("status", {"analysis_id": analysis_id, "status": status})
+        while loop.time() < deadline:
+            if await request.is_disconnected():
+                return
+            try:
+                event, data = await asyncio.wait_for(q.get(), timeout=settings.analyze_events_poll_s)
+            except asyncio.TimeoutError:
+                # respaldo: el análisis puede correr en un worker de otro proceso
+                status, result = await run_in_threadpool(_poll_status, analysis_id)
+                if status in TERMINAL:
+                    yield _sse("done", {"analysis_id": analysis_id, "status": status, "result_json": result})
+                    return
+                yield ": ping\n\n"
+                continue
+            yield _sse(event, data)
+            if event == "done":
+                return
+        yield _sse("timeout", {"analysis_id": analysis_id})
+    finally:
+        broker.unsubscribe(analysis_id, q)
+
+@router.get("/analyze/{analysis_id}/events", summary="Eventos del análisis (Server-Sent Events)",
+            response_class=StreamingResponse)
+async def analysis_events(analysis_id: int, request: Request, user: Principal = Depends(get_current_user_stream)):
+    """
+    Una conexión por cliente en lugar de sondear GET /analyze/{id}: emite `status`,
+    `progress` (años descargados / celdas del lote) y `done` con el `result_json` final.
+    Acepta el token como Bearer o `?access_token=` (EventSource).
+    """
+    owner = await run_in_threadpool(_owner_of, analysis_id)
+    if owner != user.id:
+        raise HTTPException(status_code=404, detail="No encontrado")
+    q = broker.subscribe(analysis_id)
+    return StreamingResponse(_event_stream(request, analysis_id, q), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
@@ -2,23 +2,39 @@
 from fastapi import APIRouter, Depends, HTTPException, Request
 from fastapi.security import OAuth2PasswordRequestForm
 from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
 
-from app.db import Base, engine
-from app.models import User, Role, UserRole, RefreshToken, LoginEvent
+from app.db import engine, init_schema
+from app.models import User, Role, UserRole, LoginEvent
 from app.schemas import TokenOut, UserOut, LoginEventOut
-from app.security import (
-    verify_password, hash_password,
-    create_access_token, create_refresh_token, decode_token
-)
+from app.security import create_access_token, decode_token
 from app.deps import get_db, get_current_user
+from app.principals import Principal, lookup
+from app.services import audit, passwords, refresh_tokens
 
 router = APIRouter(prefix="/v1/auth", tags=["auth"])
 
-# Crea tablas si no existen (demo; en producción usa Alembic)
-Base.metadata.create_all(bind=engine)
+# Crea tablas si no existen y completa las existentes (demo; en producción usa Alembic)
+init_schema(engine)
 
 from pydantic import BaseModel, EmailStr
 
+# bcrypt corre en el pool de app.services.passwords; lleno → 503 en vez de acaparar el threadpool
+_BUSY = HTTPException(status_code=503, detail="Autenticación saturada, reintenta en unos segundos",
+                      headers={"Retry-After": "1"})
+
+async def _hash(plain: str) -> str:
+    try:
+        return await passwords.hash(plain)
+    except passwords.HashBusy:
+        raise _BUSY
+
+async def _verify(plain: str, hashed: str) -> tuple[bool, str | None]:
+    try:
+        return await passwords.verify(plain, hashed)
+    except passwords.HashBusy:
+        raise _BUSY
+
 # --------- Schema de entrada para registro ---------
 class RegisterIn(BaseModel):
     email: EmailStr
@@ -30,15 +46,21 @@ class RegisterIn(BaseModel):
     description="Crea un nuevo usuario en el sistema. Por defecto, asigna rol 'user'.",
     status_code=201
 )
-def register(payload: RegisterIn, db: Session = Depends(get_db)):
+async def register(payload: RegisterIn, db: Session = Depends(get_db)):
     # Verificar si ya existe
-    existing = db.query(User).filter(User.email == payload.email).first()
+    existing = await run_in_threadpool(_find_user, db, payload.email)
     if existing:
         raise HTTPException(status_code=400, detail="El usuario ya existe")
 
+    hashed = await _hash(payload.password)
+    return await run_in_threadpool(_create_user, db, payload.email, hashed)
+
+def _find_user(db: Session, email: str) -> User | None:
+    return db.query(User).filter(User.email == email).first()
+
+def _create_user(db: Session, email: str, hashed: str) -> dict:
     # Crear nuevo usuario
-    hashed = hash_password(payload.password)
-    user = User(email=payload.email, hashed_password=hashed, is_active=True)
+    user = User(email=email, hashed_password=hashed, is_active=True)
     db.add(user)
     db.commit()
     db.refresh(user)
@@ -71,30 +93,42 @@ class LoginIn(BaseModel):
     summary="Login con JSON (email + password)",
     description="Alternativa a /token (form). Envía JSON con email y password."
 )
-def login_json(
+async def login_json(
     payload: LoginIn,
     request: Request,
     db: Session = Depends(get_db)
 ):
+    return await _login(db, request, payload.email, payload.password)
+
+async def _login(db: Session, request: Request, email: str, password: str) -> dict:
     ip = request.client.host if request.client else "unknown"
     ua = request.headers.get("user-agent", "-")
 
-    # 1) Buscar usuario por email
-    user = db.query(User).filter(User.email == payload.email).first()
-    if not user or not verify_password(payload.password, user.hashed_password) or not user.is_active:
+    # 1) Buscar usuario por email y verificar (fuera del threadpool)
+    user = await run_in_threadpool(_find_user, db, email)
+    ok, new_hash = False, None
+    if user and user.is_active:
+        ok, new_hash = await _verify(password, user.hashed_password)
+    if not ok:
         # registra intento fallido y retorna 400
-        db.add(LoginEvent(user_id=user.id if user else None, ip=ip, user_agent=ua, success=False))
-        db.commit()
+        await run_in_threadpool(_record_login, db, user.id if user else None, ip, ua, False)
         raise HTTPException(status_code=400, detail="Credenciales inválidas")
+    return await run_in_threadpool(_issue_tokens, db, user, ip, ua, new_hash)
 
+def _record_login(db: Session, user_id: int | None, ip: str, ua: str, success: bool) -> None:
+    audit.record_login(db, user_id, ip, ua, success)
+    db.commit()
+
+def _issue_tokens(db: Session, user: User, ip: str, ua: str, new_hash: str | None) -> dict:
     # 2) Emitir tokens
     role_names = [r.name for r in (user.roles or [])]
-    access, expires_in = create_access_token(sub=user.email, roles=role_names)
-    refresh = create_refresh_token(sub=user.email)
+    access, expires_in = create_access_token(sub=user.email, roles=role_names, uid=user.id)
 
-    # 3) Guardar refresh + evento de login
-    db.add(RefreshToken(user_id=user.id, token=refresh))
-    db.add(LoginEvent(user_id=user.id, ip=ip, user_agent=ua, success=True))
+    # 3) Guardar refresh (síncrono, solo su digest) + evento de login (write-behind)
+    refresh = refresh_tokens.issue(db, user.id, user.email)
+    if new_hash:  # hash con los parámetros vigentes
+        user.hashed_password = new_hash
+    audit.record_login(db, user.id, ip, ua, True)
     db.commit()
 
     # 4) ¡Siempre retornar el objeto con el shape de TokenOut!
@@ -114,36 +148,15 @@ def login_json(
         200: {"description": "Login exitoso"},
         400: {"description": "Credenciales inválidas"},
         429: {"description": "Rate limit alcanzado"},
+        503: {"description": "Hashing de contraseñas saturado (Retry-After)"},
     },
 )
-def login(
+async def login(
     request: Request,
     form: OAuth2PasswordRequestForm = Depends(),
     db: Session = Depends(get_db),
 ):
-    user = db.query(User).filter(User.email == form.username).first()
-    ip = request.client.host if request.client else "unknown"
-    ua = request.headers.get("user-agent", "-")
-
-    if not user or not verify_password(form.password, user.hashed_password) or not user.is_active:
-        db.add(LoginEvent(user_id=user.id if user else None, ip=ip, user_agent=ua, success=False))
-        db.commit()
-        raise HTTPException(status_code=400, detail="Credenciales inválidas")
-
-    role_names = [r.name for r in (user.roles or [])]
-    access, expires_in = create_access_token(sub=user.email, roles=role_names)
-    refresh = create_refresh_token(sub=user.email)
-
-    db.add(RefreshToken(user_id=user.id, token=refresh))
-    db.add(LoginEvent(user_id=user.id, ip=ip, user_agent=ua, success=True))
-    db.commit()
-
-    return {
-        "access_token": access,
-        "refresh_token": refresh,
-        "expires_in": expires_in,
-        "token_type": "bearer",
-    }
+    return await _login(db, request, form.username, form.password)
 
 
 @router.post("/refresh", response_model=TokenOut)
@@ -152,58 +165,49 @@ def refresh_token(payload: dict, db: Session = Depends(get_db)):
     if not token:
         raise HTTPException(status_code=400, detail="Falta refresh_token")
 
-    row = (
-        db.query(RefreshToken)
-        .filter(RefreshToken.token == token, RefreshToken.revoked == False)
-        .first()
-    )
-    if not row:
+    # firma + exp del JWT y set de revocados en memoria: sin consulta a refresh_tokens
+    try:
+        data = decode_token(token)
+    except Exception:
+        data = {}
+    if data.get("type") != "refresh" or refresh_tokens.is_revoked(token):
         raise HTTPException(status_code=401, detail="Refresh inválido o revocado")
 
-    data = decode_token(token)
-    email = data.get("sub")
-    user = db.query(User).filter(User.email == email, User.is_active == True).first()
+    user = lookup(db, data.get("uid"), data.get("sub"))
     if not user:
         raise HTTPException(status_code=401, detail="Usuario no encontrado/activo")
 
-    role_names = [r.name for r in (user.roles or [])]
-    access, expires_in = create_access_token(sub=user.email, roles=role_names)
+    access, expires_in = create_access_token(sub=user.email, roles=list(user.roles), uid=user.id)
     return {"access_token": access, "token_type": "bearer", "expires_in": expires_in}
 
 
 @router.post("/logout")
 def logout(
     payload: dict,
-    current: User = Depends(get_current_user),
+    current: Principal = Depends(get_current_user),
     db: Session = Depends(get_db),
 ):
     token = payload.get("refresh_token")
     if not token:
         raise HTTPException(status_code=400, detail="Falta refresh_token")
 
-    row = (
-        db.query(RefreshToken)
-        .filter(RefreshToken.token == token, RefreshToken.revoked == False)
-        .first()
-    )
-    if not row or row.user_id != current.id:
+    if not refresh_tokens.revoke(db, token, current.id):
         raise HTTPException(status_code=400, detail="Refresh token no válido para este usuario")
-
-    row.revoked = True
-    db.commit()
     return {"status": "ok"}
 
 
 @router.get("/me", response_model=UserOut)
-def me(current: User = Depends(get_current_user)):
-    return current
+def me(current: Principal = Depends(get_current_user), db: Session = Depends(get_db)):
+    # perfil completo (roles con id) desde la BD; el principal solo trae nombres
+    return db.get(User, current.id)
 
 
 @router.get("/history", response_model=list[LoginEventOut])
 def login_history(
-    current: User = Depends(get_current_user),
+    current: Principal = Depends(get_current_user),
     db: Session = Depends(get_db),
 ):
+    audit.login_events.flush()  # incluye los eventos aún en el buffer
     events = (
         db.query(LoginEvent)
         .filter(LoginEvent.user_id == current.id)
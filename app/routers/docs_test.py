@@ -2,7 +2,7 @@ from fastapi import APIRouter, Depends, HTTPException
 from pydantic import BaseModel, Field
 from typing import List, Literal
 from app.deps import get_current_user, require_roles
-from app.models import User
+from app.principals import Principal
 
 router = APIRouter(prefix="/v1/test", tags=["test"])
 
@@ -43,8 +43,8 @@ def public_echo(payload: EchoIn):
     summary="Ping protegido (requiere Bearer)",
     description="Devuelve info del usuario autenticado."
 )
-def protected_ping(user: User = Depends(get_current_user)):
-    roles = [r.name for r in (user.roles or [])]
+def protected_ping(user: Principal = Depends(get_current_user)):
+    roles = list(user.roles)
     return {"echoed": "protected-ok", "user": user.email, "roles": roles}
 
 @router.post(
@@ -53,8 +53,8 @@ def protected_ping(user: User = Depends(get_current_user)):
     summary="Echo protegido (requiere Bearer)",
     description="Echo que asocia el mensaje al usuario autenticado."
 )
-def protected_echo(payload: EchoIn, user: User = Depends(get_current_user)):
-    roles = [r.name for r in (user.roles or [])]
+def protected_echo(payload: EchoIn, user: Principal = Depends(get_current_user)):
+    roles = list(user.roles)
     return {"echoed": payload.message, "user": user.email, "roles": roles}
 
 @router.delete(
@@ -63,5 +63,5 @@ def protected_echo(payload: EchoIn, user: User = Depends(get_current_user)):
     description="Endpoint de prueba que requiere rol admin.",
     responses={403: {"description": "Permisos insuficientes"}}
 )
-def admin_only(_: User = Depends(require_roles("admin"))):
+def admin_only(_: Principal = Depends(require_roles("admin"))):
     return {"status": "admin-ok"}
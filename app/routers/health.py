@@ -2,6 +2,9 @@
 from fastapi import APIRouter
 from datetime import datetime, timezone
 
+from app import rate_limit
+from app.services import passwords
+
 router = APIRouter(tags=["health"])
 
 @router.get("/health")
@@ -11,3 +14,9 @@ def health():
         "message": "Campeche Weather API running",
         "timestamp": datetime.now(timezone.utc).isoformat(),
     }
+
+@router.get("/health/metrics")
+def health_metrics():
+    # latencias y cola del pool de hashing; decisiones de rate limit que fallaron (por proceso)
+    return {"password_hashing": passwords.metrics.snapshot(),
+            "rate_limit": {"backend_errors": rate_limit.get_limiter().errors}}
@@ -1,20 +1,31 @@
 # app/routers/metadata.py
-from fastapi import APIRouter
+from fastapi import APIRouter, Request
+from fastapi.responses import JSONResponse
+from app.config import settings
 from app.services.mapper import FACTOR_TO_POWER_VARS, FACTOR_UNITS
+from app.utils.http_cache import etag_for, matches, not_modified, set_validators
 
 router = APIRouter(tags=["metadata"])
 
+def _cached_json(request: Request, payload: dict) -> JSONResponse:
+    # contenido estático por versión: ETag del propio contenido + caché pública
+    etag = etag_for(payload, settings.dataset_version)
+    cache_control = f"public, max-age={settings.http_cache_metadata_max_age_s}"
+    if matches(request, etag):
+        return not_modified(etag, cache_control)
+    return set_validators(JSONResponse(payload), etag, cache_control)
+
 @router.get("/factors")
-def list_factors():
+def list_factors(request: Request):
     """
     Lista de factores disponibles para /v1/analyze.
     """
     # comfort no usa variable directa de POWER, pero está soportado
     factors = sorted(set(list(FACTOR_TO_POWER_VARS.keys()) + ["comfort"]))
-    return {"factors": factors}
+    return _cached_json(request, {"factors": factors})
 
 @router.get("/metadata")
-def get_metadata():
+def get_metadata(request: Request):
     """
     Metadatos básicos: unidades, variables POWER por factor, fuentes.
     """
@@ -26,9 +37,9 @@ def get_metadata():
         "humidity": "NASA POWER (2m RH)",
         "comfort": "Derived from temperature+humidity (Heat Index simplified)",
     }
-    return {
+    return _cached_json(request, {
         "factors": sorted(set(list(FACTOR_TO_POWER_VARS.keys()) + ["comfort"])),
         "units": FACTOR_UNITS,
         "power_variables": FACTOR_TO_POWER_VARS,
         "sources": source_by_factor,
-    }
+    })
@@ -1,21 +1,29 @@
 # app/routers/series.py
 from __future__ import annotations
-from io import StringIO, BytesIO
-from typing import Literal
+from datetime import date
+from io import StringIO
+from typing import Annotated, Awaitable, Callable, Literal
 
 import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
 
-from fastapi import APIRouter, HTTPException
-from fastapi.responses import StreamingResponse
-from pydantic import BaseModel, Field
+from fastapi import APIRouter, HTTPException, Query, Request
+from fastapi.responses import Response, StreamingResponse
+from pydantic import BaseModel, Field, field_validator
 
 from pydantic import BaseModel
 from typing import List, Optional
 
 
-from app.datasources.power_client import fetch_window_all_years
+from app.datasources.grid import snap
+from app.config import settings
+from app.datasources.power_client import fetch_window_all_years_async
+from app.datasources.power_store import store as power_store
+from app.services import daily_export, plots
+from app.utils import encoders
+from app.utils.cache import LRUCache
+from app.utils.http_cache import etag_for, matches, not_modified, set_validators
+from app.utils.singleflight import SingleFlight
 
 router = APIRouter(tags=["series"])
 
@@ -27,7 +35,9 @@ FACTOR_TO_VAR = {
     "precipitation": ("PRECTOTCORR", "mm/día"),  # precipitación diaria corregida
 }
 
-class SeriesReq(BaseModel):
+SeriesFactor = Literal["temperature", "humidity", "windspeed", "precipitation"]
+
+class _SeriesBase(BaseModel):
     latitude: float = Field(..., ge=-90, le=90)
     longitude: float = Field(..., ge=-180, le=180)
     month: int = Field(..., ge=1, le=12)
@@ -35,46 +45,134 @@ class SeriesReq(BaseModel):
     start_year: int = Field(..., ge=1981)
     end_year: int = Field(..., ge=1981)
     half_window_days: int = Field(0, ge=0, le=30)        # 0 = solo el día exacto
-    factor: Literal["temperature", "humidity", "windspeed", "precipitation"]
+
+class SeriesReq(_SeriesBase):
+    factor: SeriesFactor
     agg: Literal["median", "mean"] = "median"            # cómo resumir la ventana por año
     trend: bool = False                                  # (solo para plot) añade línea de tendencia
 
-def _aggregate_series(df: pd.DataFrame, var: str, agg: str) -> pd.Series:
+class SeriesMultiReq(_SeriesBase):
+    factors: List[SeriesFactor] = Field(..., min_length=1, max_length=len(FACTOR_TO_VAR))
+    agg: Literal["median", "mean"] = "median"
+    trend: bool = False
+    size: Literal["full", "thumb"] = "full"              # (solo para plot)
+
+    @field_validator("factors")
+    @classmethod
+    def _unique(cls, v):
+        return list(dict.fromkeys(v))
+
+# Serie anual agregada por (celda, variable, fecha, ventana, años, agg): csv, json y plot
+# del mismo SeriesReq comparten una sola descarga/agregación
+_series_cache = LRUCache(
+    settings.series_cache_max_entries,
+    max_bytes=settings.series_cache_max_bytes,
+    ttl=settings.series_cache_ttl_s,
+    sizeof=lambda s: int(s.memory_usage(index=True, deep=True)),
+)
+_series_flight = SingleFlight()
+
+def _series_key(req: SeriesReq, var: str) -> tuple:
+    # la coordenada exacta y `trend` no cambian la serie (solo los metadatos / el dibujo)
+    return (snap(req.latitude, req.longitude).key, var, req.month, req.day,
+            req.start_year, req.end_year, req.half_window_days, req.agg)
+
+def _aggregate_frame(df: pd.DataFrame, variables: list[str], agg: str) -> pd.DataFrame:
     """
-    Agrega por año:
+    Agrega por año todas las variables en una sola pasada agrupada:
       - si half_window_days > 0 → usa mediana o media de la ventana
       - si == 0 → toma la mediana por seguridad (por si hay duplicados raros)
-    Retorna pd.Series index=año, values=valor
+    Retorna DataFrame index=año (orden cronológico), una columna por variable.
     """
-    # df ya contiene múltiplos días por año si half_window_days>0
-    if agg == "median":
-        series = df.groupby("year")[var].median(numeric_only=True)
-    else:
-        series = df.groupby("year")[var].mean(numeric_only=True)
-    # orden cronológico
-    return series.sort_index()
+    grouped = df.groupby("year")[variables]
+    return (grouped.median() if agg == "median" else grouped.mean()).sort_index()
 
-@router.post("/series/csv")
-def series_csv(req: SeriesReq):
+async def _load_frame(req: SeriesReq | SeriesMultiReq, factors: list[str]) -> pd.DataFrame:
+    """
+    Series anuales alineadas por año (una columna por factor). Las variables que no están
+    en caché se piden juntas a POWER (una descarga) y se agregan en una sola pasada;
+    cada serie queda en la caché compartida con los endpoints de un solo factor.
+    """
+    variables = [FACTOR_TO_VAR[f][0] for f in factors]
+    keys = {v: _series_key(req, v) for v in variables}
+    series = {v: _series_cache.get(k) for v, k in keys.items()}
+    missing = [v for v in variables if series[v] is None]
+    if missing:
+        async def compute() -> pd.DataFrame:
+            df = await fetch_window_all_years_async(
+                lat=req.latitude, lon=req.longitude,
+                month=req.month, day=req.day,
+                start_year=req.start_year, end_year=req.end_year,
+                half_window_days=req.half_window_days,
+                params=missing,
+            )
+            if df.empty or any(v not in df.columns for v in missing):
+                raise HTTPException(424, detail="No data returned from POWER")
+            out = _aggregate_frame(df, missing, req.agg)
+            for v in missing:
+                _series_cache.put(keys[v], out[v])
+            return out
+
+        fetched = await _series_flight.do_async(tuple(keys[v] for v in missing), compute)
+        series.update({v: fetched[v] for v in missing})
+    return pd.DataFrame({f: series[v] for f, v in zip(factors, variables)}).sort_index()
+
+async def _load_series(req: SeriesReq) -> tuple[pd.Series, str]:
     var, units = FACTOR_TO_VAR[req.factor]
+    frame = await _load_frame(req, [req.factor])
+    return frame[req.factor].rename(var), units
+
+def _plot_spec(series: pd.Series, req: SeriesReq, units: str, fmt: str, size: str) -> dict:
+    cell = snap(req.latitude, req.longitude)
+    win_txt = f"±{req.half_window_days} días, {req.agg}" if req.half_window_days > 0 else "día exacto"
+    return {
+        "years": [int(y) for y in series.index],
+        "values": [float(v) for v in series.values],
+        "ylabel": f"{req.factor} ({units})",
+        "title": (f"{req.factor.capitalize()} — {req.month:02d}-{req.day:02d} ({win_txt})\n"
+                  f"lat={req.latitude:.3f}, lon={req.longitude:.3f} (celda {cell.lat:.3f}, {cell.lon:.3f}) | "
+                  f"{req.start_year}-{req.end_year}"),
+        "units": units,
+        "trend": req.trend,
+        "fmt": fmt,
+        "size": size,
+    }
+
+def _series_etag(req: SeriesReq | SeriesMultiReq, kind: str, *extra) -> str:
+    # años aún no congelados en POWER pueden cambiar: su ETag rota a diario
+    provisional = None if power_store.is_final(req.end_year) else date.today().isoformat()
+    params = req.model_dump(exclude=None if kind.endswith("plot") else {"trend", "size"})
+    return etag_for("series", kind, params, settings.dataset_version, provisional, *extra)
 
-    df = fetch_window_all_years(
-        lat=req.latitude, lon=req.longitude,
-        month=req.month, day=req.day,
-        start_year=req.start_year, end_year=req.end_year,
-        half_window_days=req.half_window_days,
-        params=[var],
-    )
-    if df.empty or var not in df.columns:
-        raise HTTPException(424, detail="No data returned from POWER")
+async def _conditional(request: Request, etag: str, build: Callable[[], Awaitable[Response]]) -> Response:
+    """
+    ETag + Cache-Control pública; en GET, If-None-Match vigente → 304 sin recalcular
+    (POST no se guarda en cachés HTTP: solo lleva los validadores).
+    """
+    cache_control = f"public, max-age={settings.http_cache_series_max_age_s}"
+    if request.method == "GET" and matches(request, etag):
+        return not_modified(etag, cache_control)
+    return set_validators(await build(), etag, cache_control)
+
+@router.post("/series/csv")
+async def series_csv(req: SeriesReq, request: Request):
+    return await _conditional(request, _series_etag(req, "csv"), lambda: _series_csv(req))
 
-    series = _aggregate_series(df, var, req.agg)
+@router.get("/series/csv", summary="Serie anual en CSV (GET cacheable)")
+async def series_csv_get(request: Request, req: Annotated[SeriesReq, Query()]):
+    return await series_csv(req, request)
+
+async def _series_csv(req: SeriesReq) -> Response:
+    series, units = await _load_series(req)
+    cell = snap(req.latitude, req.longitude)
 
     out = pd.DataFrame({
         "year": series.index.astype(int),
         f"{req.factor}": series.values,
         "lat": req.latitude,
         "lon": req.longitude,
+        "grid_lat": cell.lat,
+        "grid_lon": cell.lon,
         "month": req.month,
         "day": req.day,
         "half_window_days": req.half_window_days,
@@ -91,58 +189,151 @@ def series_csv(req: SeriesReq):
     headers = {"Content-Disposition": f'attachment; filename="{filename}"'}
     return StreamingResponse(iter([buf.getvalue()]), media_type="text/csv", headers=headers)
 
-@router.post("/series/plot.png")
-def series_plot(req: SeriesReq):
-    var, units = FACTOR_TO_VAR[req.factor]
+async def _series_plot(req: SeriesReq, fmt: str, size: str):
+    series, units = await _load_series(req)
 
-    df = fetch_window_all_years(
-        lat=req.latitude, lon=req.longitude,
-        month=req.month, day=req.day,
-        start_year=req.start_year, end_year=req.end_year,
-        half_window_days=req.half_window_days,
-        params=[var],
-    )
-    if df.empty or var not in df.columns:
-        raise HTTPException(424, detail="No data returned from POWER")
-
-    series = _aggregate_series(df, var, req.agg)
-
-    # --- Plot ---
-    fig, ax = plt.subplots(figsize=(9, 4.5))
-    ax.plot(series.index.values, series.values, marker="o")
-    ax.set_xlabel("Año")
-    ax.set_ylabel(f"{req.factor} ({units})")
-    win_txt = f"±{req.half_window_days} días, {req.agg}" if req.half_window_days > 0 else "día exacto"
-    ax.set_title(f"{req.factor.capitalize()} — {req.month:02d}-{req.day:02d} ({win_txt})\n"
-                 f"lat={req.latitude:.3f}, lon={req.longitude:.3f} | {req.start_year}-{req.end_year}")
-
-    # (Opcional) línea de tendencia lineal
-    if req.trend and len(series) >= 2:
-        years = series.index.values.astype(float)
-        vals = series.values.astype(float)
-        # ajuste lineal y = m*x + b
-        m, b = np.polyfit(years, vals, 1)
-        y_hat = m * years + b
-        ax.plot(years, y_hat, linestyle="--")  # sin especificar color (deja el default)
-        # pequeña leyenda en la esquina
-        ax.text(0.01, 0.02, f"Tendencia: {m:+.3f} {units}/año",
-                transform=ax.transAxes)
-
-    ax.grid(True, alpha=0.3)
-    plt.tight_layout()
-
-    buf = BytesIO()
-    plt.savefig(buf, format="png", dpi=130)
-    plt.close(fig)
-    buf.seek(0)
+    # render fuera del event loop (pool de procesos) y con caché de bytes
+    data = await plots.render(_plot_spec(series, req, units, fmt, size))
 
     filename = (f"{req.factor}_plot_{req.month:02d}{req.day:02d}_"
                 f"{req.start_year}-{req.end_year}_win{req.half_window_days}_{req.agg}"
-                f"{'_trend' if req.trend else ''}.png")
+                f"{'_trend' if req.trend else ''}{'_thumb' if size == 'thumb' else ''}.{fmt}")
     headers = {"Content-Disposition": f'inline; filename="{filename}"'}
-    return StreamingResponse(buf, media_type="image/png", headers=headers)
+    return Response(data, media_type=plots.MEDIA_TYPES[fmt], headers=headers)
+
+@router.post("/series/plot.png")
+async def series_plot(req: SeriesReq, request: Request, size: Literal["full", "thumb"] = Query("full")):
+    return await _conditional(request, _series_etag(req, "plot", "png", size), lambda: _series_plot(req, "png", size))
+
+class SeriesPlotQuery(SeriesReq):
+    # en GET todo va en el query string (un modelo de query no se combina con otros parámetros)
+    size: Literal["full", "thumb"] = "full"
+
+@router.get("/series/plot.png", summary="Gráfico PNG (GET cacheable)")
+async def series_plot_get(request: Request, q: Annotated[SeriesPlotQuery, Query()]):
+    return await series_plot(SeriesReq(**q.model_dump(exclude={"size"})), request, q.size)
 
+@router.post("/series/plot.svg", summary="Gráfico de la serie en SVG (vectorial)")
+async def series_plot_svg(req: SeriesReq, request: Request, size: Literal["full", "thumb"] = Query("full")):
+    return await _conditional(request, _series_etag(req, "plot", "svg", size), lambda: _series_plot(req, "svg", size))
 
+@router.get("/series/plot.svg", summary="Gráfico SVG (GET cacheable)")
+async def series_plot_svg_get(request: Request, q: Annotated[SeriesPlotQuery, Query()]):
+    return await series_plot_svg(SeriesReq(**q.model_dump(exclude={"size"})), request, q.size)
+
+
+
+# ---- Varios factores: una descarga, columnas alineadas por año ----
+MultiOutput = Literal["json", "csv", "plot.png", "plot.svg"]
+
+def _multi_meta(req: SeriesMultiReq, frame: pd.DataFrame) -> dict:
+    cell = snap(req.latitude, req.longitude)
+    years = frame.index.to_numpy(dtype=np.int64)
+    return {
+        "factors": req.factors,
+        "units": {f: FACTOR_TO_VAR[f][1] for f in req.factors},
+        "lat": req.latitude, "lon": req.longitude,
+        "grid_lat": cell.lat, "grid_lon": cell.lon,
+        "month": req.month, "day": req.day,
+        "half_window_days": req.half_window_days,
+        "agg": req.agg,
+        "count": int(years.size),
+        "range_years": [int(years.min()), int(years.max())] if years.size else None,
+    }
+
+async def _series_multi(req: SeriesMultiReq, output: str, fmt: str) -> Response:
+    frame = await _load_frame(req, req.factors)
+    years = frame.index.to_numpy(dtype=np.int64)
+    meta = _multi_meta(req, frame)
+    stem = (f"{'-'.join(req.factors)}_{req.month:02d}{req.day:02d}_"
+            f"{req.start_year}-{req.end_year}_win{req.half_window_days}_{req.agg}")
+
+    if output == "csv":
+        cell = snap(req.latitude, req.longitude)
+        out = frame.reset_index(names="year").assign(
+            lat=req.latitude, lon=req.longitude, grid_lat=cell.lat, grid_lon=cell.lon,
+            month=req.month, day=req.day, half_window_days=req.half_window_days,
+            **{f"{f}_units": u for f, u in meta["units"].items()}, agg=req.agg)
+        headers = {"Content-Disposition": f'attachment; filename="{stem}.csv"'}
+        return Response(out.to_csv(index=False), media_type="text/csv", headers=headers)
+
+    if output.startswith("plot."):
+        img = output.split(".", 1)[1]
+        win_txt = f"±{req.half_window_days} días, {req.agg}" if req.half_window_days > 0 else "día exacto"
+        spec = {
+            "years": years.tolist(),
+            "panels": [{"values": frame[f].to_numpy(dtype=np.float64).tolist(),
+                        "ylabel": f"{f} ({FACTOR_TO_VAR[f][1]})", "units": FACTOR_TO_VAR[f][1]}
+                       for f in req.factors],
+            "title": (f"{req.month:02d}-{req.day:02d} ({win_txt}) | lat={req.latitude:.3f}, lon={req.longitude:.3f} "
+                      f"(celda {meta['grid_lat']:.3f}, {meta['grid_lon']:.3f}) | {req.start_year}-{req.end_year}"),
+            "trend": req.trend,
+            "fmt": img,
+            "size": req.size,
+        }
+        data = await plots.render(spec)
+        headers = {"Content-Disposition": f'inline; filename="{stem}{"_trend" if req.trend else ""}.{img}"'}
+        return Response(data, media_type=plots.MEDIA_TYPES[img], headers=headers)
+
+    columns = {"year": years, **{f: frame[f].to_numpy(dtype=np.float64) for f in req.factors}}
+    if fmt != "json":
+        return encoders.response(fmt, encoders.encode_columns(fmt, columns, meta))
+    return encoders.response(fmt, encoders.dumps_json({
+        "years": years.tolist(),
+        "series": {f: columns[f].tolist() for f in req.factors},
+        "meta": meta,
+    }))
+
+@router.post("/series/multi/{output}", summary="Varios factores en una sola consulta (json | csv | plot.png | plot.svg)")
+async def series_multi(output: MultiOutput, req: SeriesMultiReq, request: Request):
+    """
+    Todas las variables de `factors` en una sola descarga a POWER y una sola agregación.
+    json: `years` + una lista alineada por factor en `series` (acepta Arrow / Parquet /
+    MessagePack vía Accept o `?format=`); csv: una columna por factor; plot: un panel por factor.
+    """
+    fmt = encoders.negotiate(request) if output == "json" else output
+    kind = "plot" if output.startswith("plot.") else output
+    etag = _series_etag(req, f"multi-{kind}", fmt)
+    return await _conditional(request, etag, lambda: _series_multi(req, output, fmt))
+
+@router.get("/series/multi/{output}", summary="Varios factores (GET cacheable)")
+async def series_multi_get(output: MultiOutput, request: Request, req: Annotated[SeriesMultiReq, Query()]):
+    return await series_multi(output, req, request)
+
+class DailyExportReq(BaseModel):
+    latitude: float = Field(..., ge=-90, le=90)
+    longitude: float = Field(..., ge=-180, le=180)
+    start_year: int = Field(..., ge=1981)
+    end_year: int = Field(..., ge=1981)
+    factors: List[Literal["temperature", "humidity", "windspeed", "precipitation"]] = Field(..., min_length=1)
+    format: Literal["csv", "ndjson", "arrow"] = "csv"
+
+@router.post("/series/daily", summary="Exportación diaria (CSV / NDJSON / Arrow) en streaming")
+async def series_daily(req: DailyExportReq):
+    """
+    Valores diarios crudos de la celda para todo el rango de años, emitidos año por año
+    a medida que llegan de POWER / del almacén local (memoria constante).
+    Columnas: date + una por variable POWER de los factores pedidos.
+    """
+    if req.end_year < req.start_year:
+        raise HTTPException(422, detail="end_year debe ser >= start_year")
+    if not daily_export.available(req.format):
+        raise HTTPException(406, detail="Formato arrow no disponible (requiere pyarrow)")
+    params = list(dict.fromkeys(FACTOR_TO_VAR[f][0] for f in req.factors))
+    cell = snap(req.latitude, req.longitude)
+    ext = {"csv": "csv", "ndjson": "ndjson", "arrow": "arrows"}[req.format]
+    filename = f"daily_{cell.key}_{req.start_year}-{req.end_year}.{ext}"
+    headers = {
+        "Content-Disposition": f'attachment; filename="{filename}"',
+        "X-Grid-Lat": str(cell.lat), "X-Grid-Lon": str(cell.lon),
+        "X-Accel-Buffering": "no",
+    }
+    return StreamingResponse(daily_export.export(req.format, cell, params, req.start_year, req.end_year),
+                             media_type=daily_export.MEDIA_TYPES[req.format], headers=headers)
+
+@router.get("/series/daily", summary="Exportación diaria en streaming (GET)")
+async def series_daily_get(q: Annotated[DailyExportReq, Query()]):
+    return await series_daily(q)
 
 class SeriesPoint(BaseModel):
     year: int
@@ -163,33 +354,41 @@ class SeriesJSON(BaseModel):
     ),
     responses={424: {"description": "No data returned from POWER"}}
 )
-def series_json(req: SeriesReq):
-    var, units = FACTOR_TO_VAR[req.factor]
+async def series_json(req: SeriesReq, request: Request):
+    """
+    Formatos por `Accept` (o `?format=`): JSON (por defecto), MessagePack, Arrow IPC o Parquet.
+    Los binarios son columnares (`year`, `value`) y los metadatos van en el esquema / en `meta`.
+    """
+    fmt = encoders.negotiate(request)
+    return await _conditional(request, _series_etag(req, "json", fmt), lambda: _series_json(req, fmt))
 
-    df = fetch_window_all_years(
-        lat=req.latitude, lon=req.longitude,
-        month=req.month, day=req.day,
-        start_year=req.start_year, end_year=req.end_year,
-        half_window_days=req.half_window_days,
-        params=[var],
-    )
-    if df.empty or var not in df.columns:
-        raise HTTPException(424, detail="No data returned from POWER")
+@router.get("/series/json", response_model=SeriesJSON, summary="Serie anual en JSON (GET cacheable)",
+            responses={424: {"description": "No data returned from POWER"}})
+async def series_json_get(request: Request, req: Annotated[SeriesReq, Query()]):
+    return await series_json(req, request)
 
-    series = _aggregate_series(df, var, req.agg)
+async def _series_json(req: SeriesReq, fmt: str = "json") -> Response:
+    series, units = await _load_series(req)
 
-    points = [SeriesPoint(year=int(y), value=float(v)) for y, v in series.items()]
+    years = series.index.to_numpy(dtype=np.int64)
+    values = series.to_numpy(dtype=np.float64)
+    cell = snap(req.latitude, req.longitude)
     meta = {
         "factor": req.factor,
         "units": units,
         "lat": req.latitude,
         "lon": req.longitude,
+        "grid_lat": cell.lat,
+        "grid_lon": cell.lon,
         "month": req.month,
         "day": req.day,
         "half_window_days": req.half_window_days,
         "agg": req.agg,
-        "count": len(points),
-        "range_years": [int(series.index.min()), int(series.index.max())] if len(series) else None,
+        "count": int(years.size),
+        "range_years": [int(years.min()), int(years.max())] if years.size else None,
     }
-    return {"points": points, "meta": meta}
-
+    if fmt != "json":
+        return encoders.response(fmt, encoders.encode_columns(fmt, {"year": years, "value": values}, meta))
+    # sin modelos por punto: dicts planos desde los arreglos + orjson
+    points = [{"year": y, "value": v} for y, v in zip(years.tolist(), values.tolist())]
+    return encoders.response(fmt, encoders.dumps_json({"points": points, "meta": meta}))
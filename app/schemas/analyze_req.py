@@ -2,6 +2,12 @@ from pydantic import BaseModel, Field, field_validator
 from typing import List
 
 ALLOWED_FACTORS = {"temperature","precipitation","windspeed","humidity","comfort"}
+MAX_BATCH_ITEMS = 500
+
+def _check_factors(v: List[str]) -> List[str]:
+    bad = [f for f in v if f not in ALLOWED_FACTORS]
+    if bad: raise ValueError(f"Unsupported factors: {bad}")
+    return v
 
 class AnalyzeReq(BaseModel):
     latitude: float = Field(..., ge=-90, le=90)
@@ -16,6 +22,23 @@ class AnalyzeReq(BaseModel):
     @field_validator("factors")
     @classmethod
     def validate_factors(cls, v: List[str]) -> List[str]:
-        bad = [f for f in v if f not in ALLOWED_FACTORS]
-        if bad: raise ValueError(f"Unsupported factors: {bad}")
-        return v
+        return _check_factors(v)
+
+class AnalyzeBatchItem(BaseModel):
+    latitude: float = Field(..., ge=-90, le=90)
+    longitude: float = Field(..., ge=-180, le=180)
+    month: int = Field(..., ge=1, le=12)
+    day: int = Field(..., ge=1, le=31)
+
+class AnalyzeBatchReq(BaseModel):
+    """Muchas ubicaciones/fechas con factores, ventana y rango de años comunes."""
+    items: List[AnalyzeBatchItem] = Field(..., min_length=1, max_length=MAX_BATCH_ITEMS)
+    start_year: int = Field(..., ge=1981)
+    end_year: int = Field(..., ge=1981)
+    half_window_days: int = Field(10, ge=0, le=30)
+    factors: List[str] = Field(default=["temperature","precipitation","windspeed","humidity"])
+
+    @field_validator("factors")
+    @classmethod
+    def validate_factors(cls, v: List[str]) -> List[str]:
+        return _check_factors(v)
@@ -23,5 +23,6 @@ class AnalyzeHistoryItem(BaseModel):
 class AnalyzeHistoryOut(BaseModel):
     page: int
     page_size: int
-    total: int
+    total: Optional[int] = None           # solo con include_total=true
+    next_cursor: Optional[str] = None     # None → última página
     items: list[AnalyzeHistoryItem]
@@ -1,29 +1,43 @@
 # app/security.py
 from datetime import datetime, timedelta, timezone
-from typing import List
+from typing import List, Optional
+from uuid import uuid4
 from jose import jwt
 from passlib.context import CryptContext
 from app.config import settings
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# rondas fijas (min = max = default): un hash con otro costo "necesita update" y se rehace al login
+_rounds = settings.password_bcrypt_rounds
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__default_rounds=_rounds,
+                           bcrypt__min_rounds=_rounds, bcrypt__max_rounds=_rounds)
 
+# CPU pura (~250 ms con 12 rondas): los endpoints las llaman vía app.services.passwords
 def hash_password(plain: str) -> str:
     return pwd_context.hash(plain)
 
 def verify_password(plain: str, hashed: str) -> bool:
     return pwd_context.verify(plain, hashed)
 
-def create_access_token(sub: str, roles: List[str]) -> tuple[str, int]:
+def verify_and_update(plain: str, hashed: str) -> tuple[bool, Optional[str]]:
+    """(válida, hash nuevo si los parámetros cambiaron; None si no hace falta rehacerlo)."""
+    return pwd_context.verify_and_update(plain, hashed)
+
+def create_access_token(sub: str, roles: List[str], uid: Optional[int] = None) -> tuple[str, int]:
     # ⚠️ usa minúsculas: access_min, jwt_secret, jwt_algo
     exp = datetime.now(timezone.utc) + timedelta(minutes=settings.access_min)
-    payload = {"sub": sub, "roles": roles, "exp": exp}
+    payload = {"sub": sub, "roles": roles, "exp": exp, "type": "access"}
+    if uid is not None:  # id del usuario: permite resolver el principal sin consultar por email
+        payload["uid"] = uid
     token = jwt.encode(payload, settings.jwt_secret, algorithm=settings.jwt_algo)
     return token, settings.access_min * 60
 
-def create_refresh_token(sub: str) -> str:
+def create_refresh_token(sub: str, uid: Optional[int] = None) -> tuple[str, datetime]:
     exp = datetime.now(timezone.utc) + timedelta(days=settings.refresh_days)
-    payload = {"sub": sub, "type": "refresh", "exp": exp}
-    return jwt.encode(payload, settings.jwt_secret, algorithm=settings.jwt_algo)
+    # jti: dos logins en el mismo segundo no producen el mismo token (ni el mismo digest)
+    payload = {"sub": sub, "type": "refresh", "exp": exp, "jti": uuid4().hex}
+    if uid is not None:
+        payload["uid"] = uid
+    return jwt.encode(payload, settings.jwt_secret, algorithm=settings.jwt_algo), exp
 
 def decode_token(token: str) -> dict:
     return jwt.decode(token, settings.jwt_secret, algorithms=[settings.jwt_algo])
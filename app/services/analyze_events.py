@@ -0,0 +1,55 @@
+# app/services/analyze_events.py
+from __future__ import annotations
+import asyncio
+import threading
+from collections import defaultdict
+
+TERMINAL = ("ok", "error")
+
+class EventBroker:
+    """
+    Pub/sub en proceso de eventos de análisis (progreso y fin) hacia los streams SSE.
+    `publish` se puede llamar desde cualquier hilo; cada suscriptor recibe en su event loop.
+    Los análisis que corren en otro proceso (workers de la cola) no pasan por aquí:
+    el stream los detecta consultando el estado en BD.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subs: dict[int, list[tuple[asyncio.AbstractEventLoop, asyncio.Queue]]] = defaultdict(list)
+
+    def subscribe(self, analysis_id: int) -> asyncio.Queue:
+        q: asyncio.Queue = asyncio.Queue(maxsize=256)
+        with self._lock:
+            self._subs[analysis_id].append((asyncio.get_running_loop(), q))
+        return q
+
+    def unsubscribe(self, analysis_id: int, q: asyncio.Queue) -> None:
+        with self._lock:
+            subs = [s for s in self._subs.get(analysis_id, []) if s[1] is not q]
+            if subs:
+                self._subs[analysis_id] = subs
+            else:
+                self._subs.pop(analysis_id, None)
+
+    def publish(self, analysis_id: int, event: str, data: dict) -> None:
+        with self._lock:
+            subs = list(self._subs.get(analysis_id, ()))
+        for loop, q in subs:
+            try:
+                loop.call_soon_threadsafe(_offer, q, (event, data))
+            except RuntimeError:  # loop cerrado
+                pass
+
+def _offer(q: asyncio.Queue, item) -> None:
+    try:
+        q.put_nowait(item)
+    except asyncio.QueueFull:  # cliente lento: se descarta progreso, nunca el evento final
+        if item[0] == "done":
+            q.get_nowait()
+            q.put_nowait(item)
+
+broker = EventBroker()
+
+def progress_callback(analysis_id: int):
+    return lambda data: broker.publish(analysis_id, "progress", data)
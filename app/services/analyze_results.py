@@ -0,0 +1,149 @@
+# app/services/analyze_results.py
+from __future__ import annotations
+import copy
+import hashlib, json
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from app.config import settings
+from app.datasources.grid import snap
+from app.datasources.power_store import store as power_store
+from app.models import AnalyzeResult, AnalyzeStatus
+from app.services.analyze_events import broker
+from app.services.result_store import store as blobs
+from app.utils.cache import LRUCache
+
+# params_hash → result_json canónico (segundo nivel: la columna indexada params_hash)
+_results = LRUCache(settings.analyze_result_cache_size)
+
+def sha256_json(d: dict) -> str:
+    return hashlib.sha256(json.dumps(d, sort_keys=True, separators=(",", ":")).encode()).hexdigest()
+
+def load_result(result_json: dict | None, result_uri: str | None) -> dict | None:
+    """Resultado inline o, si se guardó como blob, leído del almacén."""
+    if result_json is None and blobs.is_blob(result_uri):
+        return json.loads(blobs.read(result_uri))
+    return result_json
+
+_ROW_FIELDS = ("units", "n_years", "typical", "label", "prob_wet_day", "n_days_total")
+_PCTS = ("p10", "p50", "p90")
+
+def result_columns(result: dict) -> dict:
+    """
+    Resultado (simple o de lote) aplanado a columnas: una fila por (item, factor),
+    para salidas tabulares (Arrow / Parquet / MessagePack).
+    """
+    items = result.get("items") if "items" in result else [result]
+    cols = {k: [] for k in ("item", "ok", "message", "lat", "lon", "grid_lat", "grid_lon", "month", "day", "factor",
+                            *_ROW_FIELDS, *_PCTS)}
+    for i, it in enumerate(items):
+        loc, day = it.get("location", {}), it.get("target_day", {})
+        for factor, r in (it.get("results") or {None: {}}).items():
+            pcts = r.get("percentiles") or r.get("intensity_percentiles") or {}
+            row = {"item": i, "ok": bool(it.get("ok")), "message": it.get("message"), "factor": factor,
+                   **{k: loc.get(k) for k in ("lat", "lon", "grid_lat", "grid_lon")},
+                   "month": day.get("month"), "day": day.get("day"),
+                   **{k: r.get(k) for k in _ROW_FIELDS}, **{k: pcts.get(k) for k in _PCTS}}
+            for k, v in row.items():
+                cols[k].append(v)
+    return cols
+
+def normalize_params(params: dict) -> dict:
+    """
+    Lo que determina el resultado: celda de la malla (no la coordenada exacta),
+    fecha, años, ventana y factores ordenados.
+    """
+    def point(p):
+        return {"cell": snap(p["latitude"], p["longitude"]).key, "month": p["month"], "day": p["day"]}
+    out = {
+        "start_year": params["start_year"], "end_year": params["end_year"],
+        "half_window_days": params["half_window_days"],
+        "factors": sorted(set(params["factors"])),
+    }
+    if "items" in params:
+        out["items"] = [point(it) for it in params["items"]]
+    else:
+        out.update(point(params))
+    return out
+
+def params_hash(params: dict, dataset_version: str | None, model_version: str | None) -> str | None:
+    """
+    Clave de reutilización: parámetros normalizados + versiones de datos y de modelo.
+    None si end_year aún no está congelado en POWER: ese resultado puede cambiar, no se reutiliza.
+    """
+    if not power_store.is_final(params["end_year"]):
+        return None
+    return sha256_json({"params": normalize_params(params), "dataset_version": dataset_version,
+                        "model_version": model_version})
+
+def adapt_result(result: dict, params: dict) -> dict:
+    """Copia de un resultado reutilizado con la ubicación y factores tal como los pidió este request."""
+    out = copy.deepcopy(result)
+    if "items" in params:
+        for it, req in zip(out.get("items", []), params["items"]):
+            if "location" in it:
+                it["location"].update(lat=req["latitude"], lon=req["longitude"])
+                it["factors"] = params["factors"]
+    elif "location" in out:
+        out["location"].update(lat=params["latitude"], lon=params["longitude"])
+        out["factors"] = params["factors"]
+    return out
+
+def find_reusable(session: Session, phash: str | None, dataset_version: str | None,
+                  model_version: str | None) -> dict | None:
+    """Resultado ok con el mismo params_hash (de cualquier usuario): LRU y luego BD."""
+    if phash is None:
+        return None
+    result = _results.get(phash)
+    if result is not None:
+        return result
+    found = session.execute(
+        select(AnalyzeResult.result_json, AnalyzeResult.result_uri)
+        .where(AnalyzeResult.params_hash == phash,
+               AnalyzeResult.dataset_version == dataset_version,
+               AnalyzeResult.model_version == model_version,
+               AnalyzeResult.status == AnalyzeStatus.ok)
+        .order_by(AnalyzeResult.id.desc())
+        .limit(1)
+    ).first()
+    result = load_result(*found) if found else None
+    if result is not None:
+        _results.put(phash, result)
+    return result
+
+def store_result(row: AnalyzeResult, result: dict) -> None:
+    """
+    Resultados grandes van al almacén de blobs comprimidos (result_uri) y la fila queda
+    liviana; los pequeños (<= RESULT_INLINE_MAX_BYTES) siguen inline en result_json.
+    """
+    row.result_hash = sha256_json(result)
+    limit = settings.result_inline_max_bytes
+    # bytes canónicos (claves ordenadas): el mismo resultado → mismo digest → un solo blob
+    data = json.dumps(result, sort_keys=True, separators=(",", ":"), ensure_ascii=False).encode()
+    if limit < 0 or len(data) <= limit:
+        row.result_json, row.result_uri = result, None
+    else:
+        row.result_json = None
+        row.result_uri = blobs.put(hashlib.sha256(data).hexdigest(), data)
+
+def save_result(session: Session, analysis_id: int, result: dict | None,
+                error: Exception | str | None = None, duration_ms: int | None = None) -> None:
+    """Cierra una fila de análisis como ok (con resultado) o error."""
+    row = session.get(AnalyzeResult, analysis_id)
+    if row is None:
+        return
+    if error is None:
+        row.status = AnalyzeStatus.ok
+        store_result(row, result)
+        row.duration_ms = duration_ms
+        row.response_status = 200
+    else:
+        row.status = AnalyzeStatus.error
+        row.result_json = {"error": str(error)}
+        row.response_status = 500
+    session.commit()
+    if error is None and row.params_hash:
+        _results.put(row.params_hash, result)
+    broker.publish(analysis_id, "done", {"analysis_id": analysis_id, "status": row.status.value,
+                                         "result_json": result if error is None else row.result_json})
@@ -1,30 +1,165 @@
 # services/analyze_service.py
-from typing import List, Dict
+import asyncio
+from collections import defaultdict
+from datetime import date
+from typing import Callable, List, Dict, Optional, Sequence, Tuple
 from app.services.mapper import FACTOR_TO_POWER_VARS, FACTOR_UNITS
-from app.datasources.power_client import fetch_window_all_years
-from app.domain.stats import analyze_multifactor
+from app.services import climatology
+from app.datasources.grid import snap
+from app.datasources.power_client import (
+    fetch_window_all_years, fetch_window_all_years_async,
+    fetch_daily, fetch_daily_async, window_frame, year_windows,
+)
+from app.domain.stats import summarize_factors, yearly_inputs
 
 class AnalyzeService:
-    def run(self, lat, lon, month, day, start_year, end_year, half_window_days, factors: List[str]) -> Dict:
+    @staticmethod
+    def needed_vars(factors: List[str]) -> List[str]:
         needed_vars = set()
         for f in factors:
             needed_vars.update(FACTOR_TO_POWER_VARS.get(f, []))
             if f == "comfort":
                 needed_vars.update(["T2M", "RH2M"])
-        needed_vars = sorted(needed_vars)
+        return sorted(needed_vars)
 
-        df = fetch_window_all_years(
-            lat, lon, month, day, start_year, end_year, half_window_days, needed_vars
+    @staticmethod
+    def _fetch_progress(progress, month, day, start_year, end_year, half_window_days):
+        """Adapta el callback por rango descargado a eventos "años descargados / total"."""
+        if progress is None:
+            return None
+        windows = year_windows(month, day, start_year, end_year, half_window_days)
+        done = set()
+
+        def on_range(start, end):
+            done.update(y for y, s, e in windows if start <= s and e <= end)
+            progress({"stage": "fetch", "years_done": len(done), "years_total": len(windows)})
+        return on_range
+
+    def run(self, lat, lon, month, day, start_year, end_year, half_window_days, factors: List[str],
+            progress: Optional[Callable[[Dict], None]] = None) -> Dict:
+        needed_vars = self.needed_vars(factors)
+        # 1) índice climatológico (ubicaciones ya servidas) → 2) descarga/almacén
+        inputs = climatology.lookup(snap(lat, lon), needed_vars, month, day, start_year, end_year, half_window_days)
+        if inputs is None:
+            df = fetch_window_all_years(
+                lat, lon, month, day, start_year, end_year, half_window_days, needed_vars,
+                on_range=self._fetch_progress(progress, month, day, start_year, end_year, half_window_days),
+            )
+            inputs = yearly_inputs(df)
+        return self._summarize(inputs, lat, lon, month, day, start_year, end_year, half_window_days, factors, needed_vars)
+
+    async def run_async(self, lat, lon, month, day, start_year, end_year, half_window_days, factors: List[str],
+                        progress: Optional[Callable[[Dict], None]] = None) -> Dict:
+        needed_vars = self.needed_vars(factors)
+        inputs = await asyncio.to_thread(
+            climatology.lookup, snap(lat, lon), needed_vars, month, day, start_year, end_year, half_window_days
         )
-        if df.empty:
+        if inputs is None:
+            df = await fetch_window_all_years_async(
+                lat, lon, month, day, start_year, end_year, half_window_days, needed_vars,
+                on_range=self._fetch_progress(progress, month, day, start_year, end_year, half_window_days),
+            )
+            inputs = yearly_inputs(df)
+        return self._summarize(inputs, lat, lon, month, day, start_year, end_year, half_window_days, factors, needed_vars)
+
+    # ---- Lote: muchas (lat, lon, mes, día) con factores/ventana/años comunes ----
+    # items: secuencia de (lat, lon, month, day)
+
+    def run_batch(self, items: Sequence[Tuple], start_year, end_year, half_window_days, factors: List[str],
+                  progress: Optional[Callable[[Dict], None]] = None) -> Dict:
+        needed_vars = self.needed_vars(factors)
+        results, groups = self._batch_groups(items, start_year, end_year)
+        report = self._batch_progress(progress, groups, len(items))
+        for cell, ks in groups.items():
+            inputs, missing, windows = self._batch_lookup(cell, ks, items, needed_vars, start_year, end_year, half_window_days)
+            if missing:
+                daily = fetch_daily(cell, windows, needed_vars)  # una descarga por celda
+                self._batch_fill(inputs, missing, daily, cell, items, start_year, end_year, half_window_days)
+            self._batch_summarize(results, ks, inputs, items, start_year, end_year, half_window_days, factors, needed_vars)
+            report(ks)
+        return {"ok": True, "count": len(items), "items": results}
+
+    async def run_batch_async(self, items: Sequence[Tuple], start_year, end_year, half_window_days, factors: List[str],
+                              progress: Optional[Callable[[Dict], None]] = None) -> Dict:
+        needed_vars = self.needed_vars(factors)
+        results, groups = self._batch_groups(items, start_year, end_year)
+        report = self._batch_progress(progress, groups, len(items))
+
+        async def one_cell(cell, ks):
+            inputs, missing, windows = await asyncio.to_thread(
+                self._batch_lookup, cell, ks, items, needed_vars, start_year, end_year, half_window_days
+            )
+            if missing:
+                daily = await fetch_daily_async(cell, windows, needed_vars)
+                self._batch_fill(inputs, missing, daily, cell, items, start_year, end_year, half_window_days)
+            self._batch_summarize(results, ks, inputs, items, start_year, end_year, half_window_days, factors, needed_vars)
+            report(ks)
+
+        await asyncio.gather(*(one_cell(cell, ks) for cell, ks in groups.items()))
+        return {"ok": True, "count": len(items), "items": results}
+
+    @staticmethod
+    def _batch_groups(items, start_year, end_year):
+        """Agrupa por celda de la malla; fechas imposibles (29-feb en año no bisiesto) se responden aparte."""
+        results: List[Dict | None] = [None] * len(items)
+        groups = defaultdict(list)
+        for k, (lat, lon, month, day) in enumerate(items):
+            try:
+                for y in range(start_year, end_year + 1):
+                    date(y, month, day)
+            except ValueError as e:
+                results[k] = {"ok": False, "message": str(e)}
+                continue
+            groups[snap(lat, lon)].append(k)
+        return results, groups
+
+    @staticmethod
+    def _batch_progress(progress, groups, n_items):
+        """Callback por celda terminada → evento "celdas/items listos"."""
+        state = {"cells": 0, "items": n_items - sum(len(ks) for ks in groups.values())}  # inválidos ya resueltos
+
+        def report(ks):
+            state["cells"] += 1
+            state["items"] += len(ks)
+            if progress is not None:
+                progress({"stage": "batch", "cells_done": state["cells"], "cells_total": len(groups),
+                          "items_done": state["items"], "items_total": n_items})
+        return report
+
+    @staticmethod
+    def _batch_lookup(cell, ks, items, needed_vars, start_year, end_year, half_window_days):
+        month_days = [(items[k][2], items[k][3]) for k in ks]
+        inputs = dict(zip(ks, climatology.lookup_many(cell, needed_vars, month_days, start_year, end_year, half_window_days)))
+        missing = [k for k in ks if inputs[k] is None]
+        windows = [w for k in missing
+                   for w in year_windows(items[k][2], items[k][3], start_year, end_year, half_window_days)]
+        return inputs, missing, windows
+
+    @staticmethod
+    def _batch_fill(inputs, missing, daily, cell, items, start_year, end_year, half_window_days):
+        for k in missing:
+            lat, lon, month, day = items[k]
+            windows = year_windows(month, day, start_year, end_year, half_window_days)
+            inputs[k] = yearly_inputs(window_frame(daily, windows, cell, lat, lon))
+
+    def _batch_summarize(self, results, ks, inputs, items, start_year, end_year, half_window_days, factors, needed_vars):
+        for k in ks:
+            lat, lon, month, day = items[k]
+            results[k] = self._summarize(inputs[k], lat, lon, month, day, start_year, end_year,
+                                         half_window_days, factors, needed_vars)
+
+    def _summarize(self, inputs, lat, lon, month, day, start_year, end_year, half_window_days, factors, needed_vars) -> Dict:
+        per_year, precip = inputs
+        if per_year.empty:
             return {"ok": False, "message": "No data from POWER"}
 
-        results = analyze_multifactor(df, factors, half_window_days)
+        results = summarize_factors(per_year, precip, factors, half_window_days)
+        cell = snap(lat, lon)
         return {
             "ok": True,
-            "location": {"lat": lat, "lon": lon},
+            "location": {"lat": lat, "lon": lon, "grid_lat": cell.lat, "grid_lon": cell.lon},
             "target_day": {"month": month, "day": day, "half_window_days": half_window_days},
-            "years": {"start": start_year, "end": end_year, "count": int(df['year'].nunique())},
+            "years": {"start": start_year, "end": end_year, "count": int(per_year['year'].nunique())},
             "power_variables": needed_vars,
             "factors": factors,
             "results": results
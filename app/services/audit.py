@@ -0,0 +1,105 @@
+# app/services/audit.py
+from __future__ import annotations
+import logging
+import threading
+from collections import deque
+from datetime import datetime, timezone
+from typing import Optional
+
+from sqlalchemy import insert
+
+from app.config import settings
+from app.db import SessionLocal
+from app.models import LoginEvent
+
+log = logging.getLogger("app.services.audit")
+
+class LoginEventWriter:
+    """
+    Write-behind de LoginEvent: los eventos se acumulan en memoria y se insertan en lote
+    (un INSERT multi-fila por flush) al llegar a `batch_size` o cada `interval_s`.
+    El buffer es acotado: lleno, quien registra hace el flush él mismo (backpressure, no se pierden eventos).
+    La hora del evento se fija al registrarlo, no al insertarlo.
+    """
+
+    def __init__(self, batch_size: int, interval_s: float, max_buffer: int):
+        self.batch_size = max(1, batch_size)
+        self.interval_s = interval_s
+        self.max_buffer = max(self.batch_size, max_buffer)
+        self.dropped = 0
+        self._buf: deque[dict] = deque()
+        self._lock = threading.Lock()        # protege el buffer
+        self._flush_lock = threading.Lock()  # un flush a la vez (orden de inserción)
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def record(self, user_id: Optional[int], ip: str, user_agent: str, success: bool) -> None:
+        row = {"user_id": user_id, "ip": ip, "user_agent": user_agent, "success": success,
+               "when": datetime.now(timezone.utc)}
+        with self._lock:
+            self._buf.append(row)
+            pending = len(self._buf)
+        self._ensure_thread()
+        if pending >= self.max_buffer:
+            self.flush()
+        elif pending >= self.batch_size:
+            self._wake.set()
+
+    def flush(self) -> int:
+        """Inserta todo lo pendiente; retorna cuántos eventos escribió."""
+        written = 0
+        with self._flush_lock:
+            while True:
+                with self._lock:
+                    batch = [self._buf.popleft() for _ in range(min(len(self._buf), self.batch_size))]
+                if not batch:
+                    return written
+                try:
+                    with SessionLocal() as db:
+                        db.execute(insert(LoginEvent), batch)
+                        db.commit()
+                    written += len(batch)
+                except Exception:
+                    log.exception("no se pudieron guardar %s login events", len(batch))
+                    with self._lock:  # se reintentan en el próximo flush si hay lugar
+                        room = self.max_buffer - len(self._buf)
+                        self._buf.extendleft(reversed(batch[:room]))
+                        self.dropped += max(0, len(batch) - room)
+                    return written
+
+    def _ensure_thread(self) -> None:
+        if self._thread is not None or self._stop.is_set():
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="login-events-writer", daemon=True)
+                self._thread.start()
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            self._wake.wait(self.interval_s)
+            self._wake.clear()
+            self.flush()
+
+    def close(self) -> None:
+        """Shutdown: detiene el hilo y escribe lo que quede en el buffer."""
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout=10)
+            self._thread = None
+        self.flush()
+
+    def __len__(self) -> int:
+        return len(self._buf)
+
+login_events = LoginEventWriter(settings.audit_flush_batch, settings.audit_flush_interval_s,
+                                settings.audit_buffer_max)
+
+def record_login(db, user_id: Optional[int], ip: str, user_agent: str, success: bool) -> None:
+    """Evento de login: al buffer (AUDIT_WRITE_BEHIND) o, si está desactivado, en la sesión del request."""
+    if settings.audit_write_behind:
+        login_events.record(user_id, ip, user_agent, success)
+    else:
+        db.add(LoginEvent(user_id=user_id, ip=ip, user_agent=user_agent, success=success))
@@ -0,0 +1,134 @@
+# app/services/climatology.py
+from __future__ import annotations
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from app.config import settings
+from app.datasources.power_client import FILL_VALUE
+from app.datasources.power_store import store
+from app.domain.climatology import ClimatologyIndex, extend_medians
+
+# LRU en memoria de índices (celda, variable, primer año, último año)
+_lock = threading.Lock()
+_cache: "OrderedDict[tuple, ClimatologyIndex]" = OrderedDict()
+
+def _run_covering(years: list[int], start_year: int, end_year: int) -> tuple[int, int] | None:
+    """Tramo contiguo de años guardados que contiene [start_year, end_year]."""
+    have = set(years)
+    if not all(y in have for y in range(start_year, end_year + 1)):
+        return None
+    first, last = start_year, end_year
+    while first - 1 in have:
+        first -= 1
+    while last + 1 in have:
+        last += 1
+    return first, last
+
+def _build(cell_key: str, var: str, first: int, last: int) -> ClimatologyIndex:
+    """
+    Índice del tramo first..last desde el almacén. Las medianas se guardan por año de
+    inicio (`_climatology_{first}`): si cubren un prefijo (se agregó un año) se extienden
+    solo por la cola; se recalculan completas solo si faltan.
+    """
+    values = np.concatenate([np.asarray(store.get(cell_key, var, y)) for y in range(first, last + 1)])
+    values[values == FILL_VALUE] = np.nan
+    name = f"climatology_{first}"
+    medians = store.get_array(cell_key, var, name)
+    if medians is not None and medians.shape[1] == values.size:
+        return ClimatologyIndex(first, values, medians)
+    if medians is not None and medians.shape[1] < values.size:
+        medians = extend_medians(values, medians)
+    else:
+        medians = None
+    idx = ClimatologyIndex(first, values, medians)
+    # replace_prefix: borra el formato anterior (_climatology_{first}_{last})
+    store.put_array(cell_key, var, name, idx.medians, replace_prefix=f"{name}_")
+    return idx
+
+def refresh(cell_key: str, params, years) -> None:
+    """
+    Tras congelar años en el almacén (power_client._persist): deja al día el índice de
+    los tramos que los contienen, fuera del camino de las consultas.
+    """
+    for var in params:
+        have = store.years(cell_key, var)
+        done = set()
+        for y in years:
+            run = _run_covering(have, y, y)
+            if run is not None and run not in done:
+                done.add(run)
+                _build(cell_key, var, *run)
+
+def get_index(cell, var: str, first: int, last: int) -> ClimatologyIndex:
+    key = (cell.key, var, first, last)
+    with _lock:
+        idx = _cache.get(key)
+        if idx is not None:
+            _cache.move_to_end(key)
+            return idx
+
+    idx = _build(cell.key, var, first, last)  # normalmente ya precalculado por refresh
+    with _lock:
+        _cache[key] = idx
+        while len(_cache) > settings.climatology_cache_size:
+            _cache.popitem(last=False)
+    return idx
+
+def lookup(cell, params, month, day, start_year, end_year, half_window_days):
+    """
+    Resuelve una consulta desde el índice: (per_year, precip) con la misma forma que
+    domain.stats.yearly_inputs, o None si el almacén local no la cubre.
+    """
+    return lookup_many(cell, params, [(month, day)], start_year, end_year, half_window_days)[0]
+
+def lookup_many(cell, params, month_days, start_year, end_year, half_window_days):
+    """
+    Igual que lookup para varias fechas (mes, día) de la misma celda: cada índice se
+    carga una vez y las medianas anuales salen de un único gather (fechas × años).
+    """
+    misses = [None] * len(month_days)
+    if not settings.power_store_enabled or not month_days:
+        return misses
+    years = list(range(start_year, end_year + 1))
+    indices = {}
+    for var in params:
+        run = _run_covering(store.years(cell.key, var), start_year, end_year)
+        if run is None:
+            return misses
+        indices[var] = get_index(cell, var, *run)
+
+    # centros (fechas × años) por (origen, largo) de índice: el chequeo de bordes de
+    # centers() depende del largo de cada serie, no solo del año de inicio
+    ok = np.ones(len(month_days), dtype=bool)
+    centers = {}
+    for ix in indices.values():
+        shape = (ix.first_year, ix.values.size)
+        if shape in centers:
+            continue
+        rows = []
+        for k, (month, day) in enumerate(month_days):
+            c = ix.centers(month, day, years, half_window_days)
+            ok[k] &= c is not None
+            rows.append(c if c is not None else np.zeros(len(years), dtype=np.int64))
+        centers[shape] = np.vstack(rows)
+
+    def _centers(ix):
+        return centers[(ix.first_year, ix.values.size)]
+
+    medians = {var: ix.per_year_median(_centers(ix), half_window_days) for var, ix in indices.items()}
+    out = []
+    for k in range(len(month_days)):
+        if not ok[k]:
+            out.append(None)
+            continue
+        per_year = {"year": np.array(years, dtype=np.int64)}
+        per_year.update({var: m[k] for var, m in medians.items()})
+        precip = None
+        if "PRECTOTCORR" in indices:
+            ix = indices["PRECTOTCORR"]
+            precip = ix.window_values(_centers(ix)[k], half_window_days).ravel()
+        out.append((pd.DataFrame(per_year), precip))
+    return out
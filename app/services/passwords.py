@@ -0,0 +1,95 @@
+# app/services/passwords.py
+from __future__ import annotations
+import asyncio
+import multiprocessing as mp
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+
+import numpy as np
+from starlette.concurrency import run_in_threadpool
+
+from app.config import settings
+from app.security import hash_password, verify_and_update
+
+class HashBusy(Exception):
+    """Demasiados hashes en curso/cola: el endpoint responde 503 en vez de encolar sin límite."""
+
+class _Metrics:
+    """Contadores y latencias (últimas 1024 por operación) del pool de hashing."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.calls = {"hash": 0, "verify": 0}
+        self.rehashed = 0
+        self.rejected = 0
+        self._lat = {"hash": deque(maxlen=1024), "verify": deque(maxlen=1024)}
+
+    def observe(self, op: str, seconds: float) -> None:
+        with self._lock:
+            self.calls[op] += 1
+            self._lat[op].append(seconds)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            out = {"pending": _pending, "max_pending": settings.password_hash_max_pending,
+                   "workers": settings.password_hash_workers, "rounds": settings.password_bcrypt_rounds,
+                   "rejected": self.rejected, "rehashed": self.rehashed}
+            for op, lat in self._lat.items():
+                arr = np.fromiter(lat, dtype=np.float64)
+                p50, p95 = np.percentile(arr, (50, 95)) * 1000 if arr.size else (None, None)
+                out[op] = {"calls": self.calls[op],
+                           "p50_ms": None if p50 is None else round(float(p50), 1),
+                           "p95_ms": None if p95 is None else round(float(p95), 1),
+                           "max_ms": round(float(arr.max()) * 1000, 1) if arr.size else None}
+            return out
+
+metrics = _Metrics()
+_pending = 0  # solo se toca desde el event loop
+_pool: ProcessPoolExecutor | None = None
+_pool_lock = threading.Lock()
+
+def _get_pool() -> ProcessPoolExecutor | None:
+    global _pool
+    if settings.password_hash_workers <= 0:
+        return None
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=settings.password_hash_workers, mp_context=mp.get_context("spawn"))
+        return _pool
+
+async def _submit(op: str, fn, *args):
+    """Ejecuta fn fuera del threadpool de uvicorn, con un tope de trabajos pendientes."""
+    global _pending
+    if _pending >= settings.password_hash_max_pending:
+        metrics.rejected += 1
+        raise HashBusy()
+    _pending += 1
+    t0 = time.perf_counter()
+    try:
+        pool = _get_pool()
+        if pool is None:
+            return await run_in_threadpool(fn, *args)
+        return await asyncio.get_running_loop().run_in_executor(pool, fn, *args)
+    finally:
+        _pending -= 1
+        metrics.observe(op, time.perf_counter() - t0)
+
+async def hash(plain: str) -> str:
+    return await _submit("hash", hash_password, plain)
+
+async def verify(plain: str, hashed: str) -> tuple[bool, Optional[str]]:
+    """(válida, hash nuevo si PASSWORD_BCRYPT_ROUNDS cambió desde que se guardó)."""
+    ok, new_hash = await _submit("verify", verify_and_update, plain, hashed)
+    if new_hash:
+        metrics.rehashed += 1
+    return ok, new_hash
+
+def shutdown_pool() -> None:
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
@@ -0,0 +1,101 @@
+# app/services/plots.py
+from __future__ import annotations
+import asyncio
+import hashlib
+import json
+import multiprocessing as mp
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+
+import numpy as np
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+from starlette.concurrency import run_in_threadpool
+
+from app.config import settings
+from app.utils.cache import LRUCache
+
+# variantes: (figsize, dpi); la miniatura cuesta ~5x menos píxeles
+SIZES = {"full": ((9, 4.5), 130), "thumb": ((4.5, 2.25), 72)}
+MEDIA_TYPES = {"png": "image/png", "svg": "image/svg+xml"}
+
+def _draw(ax, years: np.ndarray, vals: np.ndarray, units: str, trend: bool, thumb: bool) -> None:
+    ax.plot(years, vals, marker="o")
+    # (Opcional) línea de tendencia lineal
+    if trend and len(years) >= 2:
+        ok = ~np.isnan(vals)
+        if ok.sum() >= 2:
+            # ajuste lineal y = m*x + b
+            m, b = np.polyfit(years[ok], vals[ok], 1)
+            ax.plot(years, m * years + b, linestyle="--")  # sin especificar color (deja el default)
+            if not thumb:
+                ax.text(0.01, 0.02, f"Tendencia: {m:+.3f} {units}/año", transform=ax.transAxes)
+    ax.grid(True, alpha=0.3)
+
+def render_series(spec: dict) -> bytes:
+    """
+    Dibuja series anuales con la API orientada a objetos (Figure + lienzo Agg):
+    sin estado global de pyplot, seguro en hilos y procesos. `spec` es serializable
+    (se envía al pool de procesos y define la clave de caché). Con `panels`
+    (varios factores) dibuja un subgráfico por factor con el eje de años compartido.
+    """
+    figsize, dpi = SIZES[spec.get("size", "full")]
+    thumb = spec.get("size") == "thumb"
+    panels = spec.get("panels") or [{"values": spec["values"], "ylabel": spec["ylabel"], "units": spec["units"]}]
+    if len(panels) > 1:
+        figsize = (figsize[0], figsize[1] * (0.45 + 0.55 * len(panels)))
+    fig = Figure(figsize=figsize)
+    FigureCanvasAgg(fig)
+    axes = fig.subplots(len(panels), 1, sharex=True, squeeze=False)[:, 0]
+    years = np.asarray(spec["years"], dtype=float)
+    for ax, panel in zip(axes, panels):
+        _draw(ax, years, np.asarray(panel["values"], dtype=float), panel["units"], spec.get("trend"), thumb)
+        if not thumb:
+            ax.set_ylabel(panel["ylabel"])
+    if not thumb:
+        axes[-1].set_xlabel(spec.get("xlabel", "Año"))
+        axes[0].set_title(spec["title"])
+
+    fig.tight_layout()
+    buf = BytesIO()
+    fig.savefig(buf, format=spec.get("fmt", "png"), dpi=dpi)
+    return buf.getvalue()
+
+def spec_key(spec: dict) -> str:
+    return hashlib.sha256(json.dumps(spec, sort_keys=True, separators=(",", ":")).encode()).hexdigest()
+
+# bytes ya renderizados por hash de la especificación
+_cache = LRUCache(settings.plot_cache_max_entries, max_bytes=settings.plot_cache_max_bytes,
+                  ttl=settings.series_cache_ttl_s, sizeof=len)
+_pool: ProcessPoolExecutor | None = None
+_pool_lock = threading.Lock()
+
+def _get_pool() -> ProcessPoolExecutor | None:
+    global _pool
+    if settings.plot_workers <= 0:
+        return None
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=settings.plot_workers, mp_context=mp.get_context("spawn"))
+        return _pool
+
+async def render(spec: dict) -> bytes:
+    """Bytes del gráfico (caché → pool de procesos acotado; PLOT_WORKERS=0 → threadpool)."""
+    key = spec_key(spec)
+    data = _cache.get(key)
+    if data is None:
+        pool = _get_pool()
+        if pool is None:
+            data = await run_in_threadpool(render_series, spec)
+        else:
+            data = await asyncio.get_running_loop().run_in_executor(pool, render_series, spec)
+        _cache.put(key, data)
+    return data
+
+def shutdown_pool() -> None:
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
@@ -0,0 +1,135 @@
+# app/services/refresh_tokens.py
+from __future__ import annotations
+import hashlib
+import logging
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Optional
+
+from sqlalchemy import delete, select
+from sqlalchemy.orm import Session
+
+from app.config import settings
+from app.db import SessionLocal
+from app.models import RefreshToken
+from app.security import create_refresh_token
+
+log = logging.getLogger("app.services.refresh_tokens")
+
+def digest(token: str) -> bytes:
+    """sha256 del JWT: 32 bytes de ancho fijo para el índice (el token completo no se guarda)."""
+    return hashlib.sha256(token.encode()).digest()
+
+def _ts(dt: Optional[datetime]) -> float:
+    if dt is None:
+        return float("inf")
+    return (dt if dt.tzinfo else dt.replace(tzinfo=timezone.utc)).timestamp()
+
+class RevocationSet:
+    """
+    Digests de refresh tokens revocados y aún no vencidos (digest → vence, epoch).
+    Un refresh con firma y exp válidas se acepta si su digest no está aquí: sin consulta a BD.
+    Se reconstruye desde la BD al arrancar y cada REFRESH_REVOCATION_SYNC_S
+    (revocaciones hechas por otros workers); `add` la actualiza al instante en este proceso.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._revoked: dict[bytes, float] = {}
+        self.loaded = False
+
+    def __contains__(self, token_hash: bytes) -> bool:
+        with self._lock:
+            exp = self._revoked.get(token_hash)
+        return exp is not None and exp > time.time()
+
+    def add(self, token_hash: bytes, expires_at: Optional[datetime]) -> None:
+        with self._lock:
+            self._revoked[token_hash] = _ts(expires_at)
+
+    def rebuild(self, db: Session) -> int:
+        now = datetime.now(timezone.utc)
+        rows = db.execute(
+            select(RefreshToken.token_hash, RefreshToken.expires_at)
+            .where(RefreshToken.revoked == True)
+            .where((RefreshToken.expires_at == None) | (RefreshToken.expires_at > now))
+        ).all()
+        fresh = {h: _ts(exp) for h, exp in rows}
+        cutoff = now.timestamp()
+        with self._lock:
+            # una revocación es definitiva: se conservan las locales (p. ej. hechas durante la consulta)
+            fresh.update({h: exp for h, exp in self._revoked.items() if exp > cutoff and h not in fresh})
+            self._revoked = fresh
+            self.loaded = True
+        return len(fresh)
+
+    def __len__(self) -> int:
+        return len(self._revoked)
+
+revocations = RevocationSet()
+
+def issue(db: Session, user_id: int, email: str) -> str:
+    """Emite un refresh token y agrega su fila (sin commit: va con el resto del login)."""
+    token, expires_at = create_refresh_token(sub=email, uid=user_id)
+    db.add(RefreshToken(user_id=user_id, token_hash=digest(token), expires_at=expires_at))
+    return token
+
+def is_revoked(token: str) -> bool:
+    if not revocations.loaded:
+        with SessionLocal() as db:
+            revocations.rebuild(db)
+    return digest(token) in revocations
+
+def revoke(db: Session, token: str, user_id: int) -> bool:
+    """Marca el token como revocado si es de `user_id` (índice por digest) y lo agrega al set."""
+    row = db.execute(
+        select(RefreshToken).where(RefreshToken.token_hash == digest(token), RefreshToken.revoked == False)
+    ).scalar_one_or_none()
+    if row is None or row.user_id != user_id:
+        return False
+    row.revoked = True
+    db.commit()
+    revocations.add(row.token_hash, row.expires_at)
+    return True
+
+def purge_expired(db: Session) -> int:
+    """Borra las filas de tokens vencidos (revocados o no): ya no sirven para nada."""
+    res = db.execute(delete(RefreshToken).where(RefreshToken.expires_at <= datetime.now(timezone.utc)))
+    db.commit()
+    return res.rowcount or 0
+
+# ---- mantenimiento en segundo plano: sincroniza revocaciones y purga vencidos ----
+_stop = threading.Event()
+_thread: Optional[threading.Thread] = None
+
+def _maintain() -> None:
+    last_purge = 0.0
+    while not _stop.wait(settings.refresh_revocation_sync_s):
+        try:
+            with SessionLocal() as db:
+                if time.monotonic() - last_purge >= settings.refresh_purge_interval_s:
+                    n = purge_expired(db)
+                    last_purge = time.monotonic()
+                    if n:
+                        log.info("%s refresh tokens vencidos purgados", n)
+                revocations.rebuild(db)
+        except Exception:
+            log.exception("mantenimiento de refresh tokens")
+
+def start() -> None:
+    """Startup: carga el set de revocados y lanza el hilo de mantenimiento."""
+    global _thread
+    with SessionLocal() as db:
+        revocations.rebuild(db)
+    if _thread is None:
+        _stop.clear()
+        _thread = threading.Thread(target=_maintain, name="refresh-tokens", daemon=True)
+        _thread.start()
+
+def stop() -> None:
+    global _thread
+    _stop.set()
+    if _thread is not None:
+        _thread.join(timeout=5)
+        _thread = None
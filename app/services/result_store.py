@@ -0,0 +1,86 @@
+# app/services/result_store.py
+from __future__ import annotations
+import gzip
+import os
+import tempfile
+from pathlib import Path
+from typing import IO, Iterator
+
+from app.config import settings
+
+try:  # zstd opcional (más rápido y compacto que gzip)
+    import zstandard
+except ImportError:  # pragma: no cover
+    zstandard = None
+
+SCHEME = "blob://"
+_EXT = {"gzip": ".json.gz", "zstd": ".json.zst"}
+
+class ResultStore:
+    """
+    Almacén de resultados direccionado por contenido: un archivo comprimido por sha256
+    del JSON canónico (root/ab/<hash>.json.gz|.json.zst). Resultados idénticos comparten
+    archivo y la escritura es atómica (tmp + rename), segura entre workers.
+    La fila solo guarda result_uri = "blob://<hash>.<ext>".
+    """
+
+    def __init__(self, root: str | os.PathLike, codec: str = "auto", level: int | None = None):
+        self.root = Path(root)
+        if codec == "auto":
+            codec = "zstd" if zstandard is not None else "gzip"
+        if codec == "zstd" and zstandard is None:
+            raise RuntimeError("RESULT_STORE_CODEC=zstd requiere el paquete 'zstandard'")
+        self.codec = codec
+        self.level = level
+
+    def _path(self, name: str) -> Path:
+        if "/" in name or name.startswith("."):
+            raise ValueError(f"URI de resultado inválida: {name}")
+        return self.root / name[:2] / name
+
+    def _compress(self, data: bytes) -> bytes:
+        if self.codec == "zstd":
+            return zstandard.ZstdCompressor(level=self.level or 3).compress(data)
+        return gzip.compress(data, compresslevel=self.level or 6, mtime=0)
+
+    def put(self, digest: str, data: bytes) -> str:
+        """Guarda `data` (JSON canónico cuyo sha256 es `digest`) y retorna su URI."""
+        name = digest + _EXT[self.codec]
+        path = self._path(name)
+        if not path.exists():  # mismo contenido → mismo archivo
+            path.parent.mkdir(parents=True, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    f.write(self._compress(data))
+                os.replace(tmp, path)
+            except BaseException:
+                if os.path.exists(tmp):
+                    os.unlink(tmp)
+                raise
+        return SCHEME + name
+
+    @staticmethod
+    def is_blob(uri: str | None) -> bool:
+        return bool(uri) and uri.startswith(SCHEME)
+
+    def open(self, uri: str) -> IO[bytes]:
+        """Stream descomprimido del JSON."""
+        name = uri[len(SCHEME):]
+        path = self._path(name)
+        if name.endswith(_EXT["zstd"]):
+            if zstandard is None:
+                raise RuntimeError("el resultado está en zstd y 'zstandard' no está instalado")
+            return zstandard.ZstdDecompressor().stream_reader(open(path, "rb"), closefd=True)
+        return gzip.open(path, "rb")
+
+    def read(self, uri: str) -> bytes:
+        with self.open(uri) as f:
+            return f.read()
+
+    def iter_bytes(self, uri: str, chunk_size: int = 64 * 1024) -> Iterator[bytes]:
+        with self.open(uri) as f:
+            while chunk := f.read(chunk_size):
+                yield chunk
+
+store = ResultStore(settings.result_store_dir, settings.result_store_codec)
@@ -0,0 +1,66 @@
+# app/utils/cache.py
+from __future__ import annotations
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional
+
+class LRUCache:
+    """
+    LRU en memoria, seguro entre hilos. maxsize <= 0 lo desactiva.
+    Opcionales: `max_bytes` (presupuesto de memoria, con `sizeof(value)` para medir cada
+    entrada) y `ttl` en segundos (las entradas vencidas no se devuelven).
+    """
+
+    def __init__(self, maxsize: int = 128, max_bytes: Optional[int] = None, ttl: Optional[float] = None,
+                 sizeof: Optional[Callable[[Any], int]] = None):
+        self.maxsize = maxsize
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.sizeof = sizeof
+        self.nbytes = 0
+        self._lock = threading.Lock()
+        self._data: "OrderedDict[Hashable, tuple[Any, float, int]]" = OrderedDict()  # valor, vence, bytes
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return default
+            if self.ttl is not None and item[1] <= time.monotonic():
+                self._drop(key)
+                return default
+            self._data.move_to_end(key)
+            return item[0]
+
+    def put(self, key: Hashable, value: Any) -> None:
+        if self.maxsize <= 0:
+            return
+        size = self.sizeof(value) if self.sizeof and self.max_bytes is not None else 0
+        if self.max_bytes is not None and size > self.max_bytes:
+            return  # no entra ni sola: no desaloja todo lo demás
+        expires = time.monotonic() + self.ttl if self.ttl is not None else float("inf")
+        with self._lock:
+            if key in self._data:
+                self._drop(key)
+            self._data[key] = (value, expires, size)
+            self.nbytes += size
+            while len(self._data) > self.maxsize or (self.max_bytes is not None and self.nbytes > self.max_bytes):
+                self._drop(next(iter(self._data)))
+
+    def _drop(self, key: Hashable) -> Any:
+        value, _, size = self._data.pop(key)
+        self.nbytes -= size
+        return value
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            return self._drop(key) if key in self._data else default
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self.nbytes = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
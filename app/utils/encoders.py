@@ -0,0 +1,122 @@
+# app/utils/encoders.py
+"""
+Negociación de contenido y codificadores columnares (Arrow IPC, Parquet, MessagePack)
+construidos directamente desde arreglos NumPy; JSON por orjson cuando está instalado.
+Todos los formatos binarios son opcionales: si falta la librería no se ofrecen.
+"""
+from __future__ import annotations
+import json
+import math
+from io import BytesIO
+from typing import Any, Mapping
+
+import numpy as np
+from fastapi import HTTPException, Request
+from fastapi.responses import Response
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # pragma: no cover
+    pa = pq = None
+try:
+    import msgpack
+except ImportError:  # pragma: no cover
+    msgpack = None
+
+MEDIA_TYPES = {
+    "json": "application/json",
+    "msgpack": "application/msgpack",
+    "arrow": "application/vnd.apache.arrow.stream",
+    "parquet": "application/vnd.apache.parquet",
+}
+_ALIASES = {"application/x-msgpack": "msgpack", "application/vnd.apache.arrow.file": "arrow",
+            "application/x-parquet": "parquet"}
+_BY_TYPE = {**{v: k for k, v in MEDIA_TYPES.items()}, **_ALIASES}
+
+def available() -> set[str]:
+    out = {"json"}
+    if msgpack is not None:
+        out.add("msgpack")
+    if pa is not None:
+        out.update({"arrow", "parquet"})
+    return out
+
+def negotiate(request: Request, offered: set[str] | None = None) -> str:
+    """
+    Formato de respuesta: ?format=… manda; si no, el Accept con mayor q entre los disponibles.
+    Sin coincidencia → json (406 solo si se pidió explícitamente un formato no disponible).
+    """
+    offered = (offered or set(MEDIA_TYPES)) & available()
+    explicit = request.query_params.get("format")
+    if explicit:
+        if explicit not in offered:
+            raise HTTPException(406, detail=f"Formato no disponible: {explicit} (disponibles: {sorted(offered)})")
+        return explicit
+    best, best_q = "json", 0.0
+    for part in request.headers.get("accept", "").split(","):
+        media, *opts = [p.strip() for p in part.split(";")]
+        q = 1.0
+        for o in opts:
+            if o.startswith("q="):
+                try:
+                    q = float(o[2:])
+                except ValueError:
+                    q = 0.0
+        fmt = _BY_TYPE.get(media.lower())
+        if fmt in offered and q > best_q:
+            best, best_q = fmt, q
+    return best
+
+def _nan_to_none(obj: Any) -> Any:
+    # el json estándar no admite NaN (orjson ya los emite como null)
+    if isinstance(obj, float) and math.isnan(obj):
+        return None
+    if isinstance(obj, dict):
+        return {k: _nan_to_none(v) for k, v in obj.items()}
+    if isinstance(obj, list):
+        return [_nan_to_none(v) for v in obj]
+    return obj
+
+def dumps_json(obj: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_SERIALIZE_NUMPY)
+    return json.dumps(_nan_to_none(obj), separators=(",", ":"), ensure_ascii=False).encode()
+
+def _table(columns: Mapping[str, Any], meta: dict | None):
+    table = pa.table({k: pa.array(v) for k, v in columns.items()})
+    if meta:
+        table = table.replace_schema_metadata({"meta": dumps_json(meta)})
+    return table
+
+def encode_columns(fmt: str, columns: Mapping[str, Any], meta: dict | None = None) -> bytes:
+    """Tabla (nombre → arreglo) en el formato pedido; `meta` viaja en el esquema (Arrow/Parquet)."""
+    if fmt == "arrow":
+        table = _table(columns, meta)
+        sink = pa.BufferOutputStream()
+        with pa.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+        return sink.getvalue().to_pybytes()
+    if fmt == "parquet":
+        buf = BytesIO()
+        pq.write_table(_table(columns, meta), buf, compression="zstd")
+        return buf.getvalue()
+    cols = {k: (np.asarray(v).tolist() if isinstance(v, np.ndarray) else list(v)) for k, v in columns.items()}
+    payload = {"columns": cols, "meta": meta}
+    if fmt == "msgpack":
+        return msgpack.packb(_nan_to_none(payload), use_bin_type=True)
+    return dumps_json(payload)
+
+def encode_object(fmt: str, obj: Any) -> bytes:
+    """Documentos anidados: JSON (orjson) o MessagePack."""
+    if fmt == "msgpack":
+        return msgpack.packb(_nan_to_none(obj), use_bin_type=True)
+    return dumps_json(obj)
+
+def response(fmt: str, body: bytes, headers: dict | None = None) -> Response:
+    headers = {**(headers or {}), "Vary": "Accept"}
+    return Response(body, media_type=MEDIA_TYPES[fmt], headers=headers)
@@ -1,11 +1,92 @@
 from __future__ import annotations
+import asyncio
+import threading
 import time
 from typing import Any, Dict, Optional
-import requests
+from urllib.parse import urlsplit
+import httpx
+from app.config import settings
+
+try:  # decodificador JSON rápido (opcional)
+    import orjson
+    _loads = orjson.loads
+except ImportError:  # pragma: no cover
+    import json
+    _loads = json.loads
 
 class HttpError(Exception):
     pass
 
+# Clientes compartidos con pool de conexiones (keep-alive → sin handshake TLS por llamada)
+_LIMITS = httpx.Limits(
+    max_connections=settings.http_max_connections,
+    max_keepalive_connections=settings.http_max_connections,
+)
+
+_client: Optional[httpx.Client] = None
+_client_lock = threading.Lock()
+_host_sems: Dict[str, threading.BoundedSemaphore] = {}
+
+# un cliente async (y sus semáforos por host) por event loop: un cliente no se puede usar
+# (ni cerrar) desde otro loop. loop → (cliente, semáforos, guardia que lo cierra)
+_async_states: Dict[asyncio.AbstractEventLoop, tuple] = {}
+
+def _host(url: str) -> str:
+    return urlsplit(url).netloc
+
+def _sync_client() -> httpx.Client:
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = httpx.Client(limits=_LIMITS)
+        return _client
+
+def _host_semaphore(url: str) -> threading.BoundedSemaphore:
+    with _client_lock:
+        return _host_sems.setdefault(_host(url), threading.BoundedSemaphore(settings.http_per_host_concurrency))
+
+async def _close_with_loop(client: httpx.AsyncClient):
+    """
+    Guardia del cliente de un loop: asyncio.run (y uvicorn) llaman shutdown_asyncgens antes de
+    cerrar el loop, que ejecuta este finally mientras el loop sigue vivo → aclose ordenado.
+    """
+    try:
+        yield
+    finally:
+        await client.aclose()
+
+async def _async_state(url: str) -> tuple[httpx.AsyncClient, asyncio.Semaphore]:
+    """Cliente async y semáforo por host del event loop en curso."""
+    loop = asyncio.get_running_loop()
+    state = _async_states.get(loop)
+    if state is None:
+        client = httpx.AsyncClient(limits=_LIMITS)
+        guard = _close_with_loop(client)
+        await guard.__anext__()
+        with _client_lock:
+            for other in [l for l in _async_states if l.is_closed()]:
+                del _async_states[other]  # ya cerrado por su guardia
+            state = _async_states[loop] = (client, {}, guard)
+    client, sems, _ = state
+    sem = sems.get(_host(url))
+    if sem is None:
+        sem = sems[_host(url)] = asyncio.Semaphore(settings.http_per_host_concurrency)
+    return client, sem
+
+def _retry_delay(exc: Exception, attempt: int, backoff: float) -> Optional[float]:
+    """
+    Segundos antes del próximo intento, o None si reintentar no sirve
+    (4xx que no sea 429: la misma URL va a fallar igual). Respeta Retry-After.
+    """
+    if isinstance(exc, httpx.HTTPStatusError):
+        status = exc.response.status_code
+        if status < 500 and status != 429:
+            return None
+        retry_after = exc.response.headers.get("retry-after", "")
+        if retry_after.isdigit():
+            return min(float(retry_after), 60.0)
+    return backoff ** (attempt + 1)
+
 def get_json(
     url: str,
     timeout: int = 30,
@@ -14,17 +95,63 @@ def get_json(
     headers: Optional[Dict[str, str]] = None,
 ) -> Dict[str, Any]:
     """
-    GET JSON con reintentos y backoff exponencial.
+    GET JSON con reintentos y backoff exponencial (solo errores de red, 5xx y 429).
     Lanza HttpError si la solicitud falla.
     """
     last_exc: Optional[Exception] = None
     for i in range(retries):
         try:
-            r = requests.get(url, timeout=timeout, headers=headers)
+            with _host_semaphore(url):
+                r = _sync_client().get(url, timeout=timeout, headers=headers)
+            r.raise_for_status()
+            return _loads(r.content)
+        except Exception as e:
+            last_exc = e
+            delay = _retry_delay(e, i, backoff) if i < retries - 1 else None
+            if delay is None:
+                break
+            time.sleep(delay)  # camino síncrono (worker de la cola): bloquea solo ese hilo
+    raise HttpError(f"GET failed after {i + 1} attempts for URL: {url} :: {last_exc}")
+
+async def get_json_async(
+    url: str,
+    timeout: int = 30,
+    retries: int = 3,
+    backoff: float = 1.6,
+    headers: Optional[Dict[str, str]] = None,
+) -> Dict[str, Any]:
+    """
+    Versión asyncio de get_json: concurrencia acotada por host y backoff sin bloquear el loop.
+    """
+    last_exc: Optional[Exception] = None
+    for i in range(retries):
+        try:
+            client, sem = await _async_state(url)
+            async with sem:
+                r = await client.get(url, timeout=timeout, headers=headers)
             r.raise_for_status()
-            return r.json()
+            return _loads(r.content)
         except Exception as e:
             last_exc = e
-            if i < retries - 1:
-                time.sleep(backoff ** (i + 1))
-    raise HttpError(f"GET failed after {retries} attempts for URL: {url} :: {last_exc}")
+            delay = _retry_delay(e, i, backoff) if i < retries - 1 else None
+            if delay is None:
+                break
+            await asyncio.sleep(delay)
+    raise HttpError(f"GET failed after {i + 1} attempts for URL: {url} :: {last_exc}")
+
+async def aclose_clients() -> None:
+    """Cierra los clientes compartidos (shutdown de la app): los de cada loop, cada uno en su loop."""
+    global _client
+    loop = asyncio.get_running_loop()
+    with _client_lock:
+        states = list(_async_states.items())
+        _async_states.clear()
+    for owner, (_, _, guard) in states:
+        if owner is loop:
+            await guard.aclose()
+        elif owner.is_running():  # loop vivo en otro hilo
+            await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(guard.aclose(), owner))
+    with _client_lock:
+        if _client is not None:
+            _client.close()
+            _client = None
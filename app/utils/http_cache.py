@@ -0,0 +1,32 @@
+# app/utils/http_cache.py
+from __future__ import annotations
+import hashlib
+import json
+from typing import Any
+
+from fastapi import Request, Response
+
+IMMUTABLE = "max-age=31536000, immutable"
+
+def etag_for(*parts: Any) -> str:
+    """ETag fuerte a partir de lo que determina la respuesta (parámetros, versión de datos…)."""
+    raw = json.dumps(parts, sort_keys=True, separators=(",", ":"), default=str).encode()
+    return '"' + hashlib.sha256(raw).hexdigest()[:32] + '"'
+
+def matches(request: Request, etag: str) -> bool:
+    """True si el If-None-Match del cliente ya tiene esta versión (comparación débil, RFC 9110)."""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    tags = {t.strip().removeprefix("W/") for t in header.split(",")}
+    return etag in tags
+
+def not_modified(etag: str, cache_control: str) -> Response:
+    return Response(status_code=304, headers={"ETag": etag, "Cache-Control": cache_control})
+
+def set_validators(response: Response, etag: str, cache_control: str) -> Response:
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = cache_control
+    return response
@@ -0,0 +1,104 @@
+# app/utils/singleflight.py
+from __future__ import annotations
+import asyncio
+import threading
+from typing import Any, Awaitable, Callable, Hashable
+
+class _Call:
+    __slots__ = ("event", "result", "error", "cancelled", "waiters")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result: Any = None
+        self.error: BaseException | None = None
+        self.cancelled = False  # la ejecución se canceló: los waiters eligen otro líder
+        self.waiters: list | None = []  # (loop, future) de waiters async; None al terminar
+
+def _wake(fut: asyncio.Future) -> None:
+    if not fut.done():
+        fut.set_result(None)
+
+class SingleFlight:
+    """
+    Deduplica llamadas concurrentes con la misma clave: la primera ejecuta,
+    las demás esperan y reciben el mismo resultado (o la misma excepción).
+    Un solo espacio de claves para `do` (hilos) y `do_async` (tareas de cualquier
+    event loop): una descarga en vuelo se comparte entre ambos caminos.
+    `do` bloquea el hilo: no llamarlo desde un event loop.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: dict[Hashable, _Call] = {}
+
+    def _join(self, key: Hashable) -> tuple[_Call, bool]:
+        """(llamada en vuelo para la clave, True si quien llama es el líder)."""
+        with self._lock:
+            call = self._calls.get(key)
+            if call is None:
+                call = self._calls[key] = _Call()
+                return call, True
+            return call, False
+
+    def _finish(self, key: Hashable, call: _Call, result: Any = None,
+                error: BaseException | None = None, cancelled: bool = False) -> None:
+        with self._lock:
+            if self._calls.get(key) is call:
+                del self._calls[key]
+            call.result, call.error, call.cancelled = result, error, cancelled
+            waiters, call.waiters = call.waiters, None
+        call.event.set()
+        for loop, fut in waiters:
+            try:
+                loop.call_soon_threadsafe(_wake, fut)
+            except RuntimeError:  # loop ya cerrado: nadie espera
+                pass
+
+    @staticmethod
+    def _outcome(call: _Call) -> Any:
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+    def do(self, key: Hashable, fn: Callable[[], Any]) -> Any:
+        while True:
+            call, leader = self._join(key)
+            if leader:
+                break
+            call.event.wait()
+            if not call.cancelled:
+                return self._outcome(call)
+        try:
+            result = fn()
+        except BaseException as e:
+            self._finish(key, call, error=e)
+            raise
+        self._finish(key, call, result)
+        return result
+
+    async def do_async(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        loop = asyncio.get_running_loop()
+        while True:
+            call, leader = self._join(key)
+            if leader:
+                break
+            fut = loop.create_future()
+            with self._lock:
+                pending = call.waiters is not None
+                if pending:
+                    call.waiters.append((loop, fut))
+            if pending:
+                await fut  # si este waiter se cancela, la ejecución compartida sigue
+            if not call.cancelled:
+                return self._outcome(call)
+
+        def done(task: asyncio.Task) -> None:
+            if task.cancelled():
+                self._finish(key, call, cancelled=True)
+            else:
+                self._finish(key, call, task.result() if task.exception() is None else None, task.exception())
+
+        # la ejecución es una tarea propia: cancelar al líder no la cancela ni afecta a los waiters
+        task = asyncio.ensure_future(fn())
+        task.add_done_callback(done)
+        return await asyncio.shield(task)
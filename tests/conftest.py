@@ -0,0 +1,12 @@
+# tests/conftest.py
+import os
+import tempfile
+
+# la configuración se lee al importar app.config: valores de prueba antes de cualquier import de app
+_tmp = tempfile.mkdtemp(prefix="app-tests-")
+os.environ.setdefault("JWT_SECRET", "test-secret")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{_tmp}/test.db")
+os.environ.setdefault("RATE_LIMIT_ENABLED", "0")
+os.environ.setdefault("PASSWORD_HASH_WORKERS", "0")
+os.environ.setdefault("POWER_STORE_DIR", f"{_tmp}/power")
+os.environ.setdefault("RESULT_STORE_DIR", f"{_tmp}/results")
@@ -0,0 +1,47 @@
+# tests/test_analyze_reuse.py
+from datetime import date
+
+import pytest
+
+from app.db import SessionLocal, engine, init_schema
+from app.models import AnalyzeResult, AnalyzeStatus, User
+from app.services import analyze_results as ar
+
+PARAMS = {"latitude": -33.45, "longitude": -70.66, "month": 6, "day": 15, "start_year": 1990,
+          "end_year": 2000, "half_window_days": 7, "factors": ["rain", "hot"]}
+RESULT = {"ok": True, "results": {"rain": {"prob_wet_day": 0.2}}}
+
+@pytest.fixture
+def db():
+    init_schema(engine)
+    ar._results.clear()
+    with SessionLocal() as session:
+        user = User(email=f"reuse-{id(session)}@example.com", hashed_password="x")
+        session.add(user)
+        session.commit()
+        session.info["user_id"] = user.id
+        yield session
+
+def _save(db, params, model_version, dataset_version="POWER-2024"):
+    row = AnalyzeResult(user_id=db.info["user_id"], status=AnalyzeStatus.running, params_json=params,
+                        model_version=model_version, dataset_version=dataset_version,
+                        params_hash=ar.params_hash(params, dataset_version, model_version))
+    db.add(row)
+    db.commit()
+    ar.save_result(db, row.id, RESULT)
+    return row
+
+def test_reuse_requires_same_model_version(db):
+    _save(db, PARAMS, "v1")
+    for _ in range(2):  # BD y luego LRU
+        assert ar.find_reusable(db, ar.params_hash(PARAMS, "POWER-2024", "v1"), "POWER-2024", "v1") == RESULT
+    ar._results.clear()
+    assert ar.params_hash(PARAMS, "POWER-2024", "v2") != ar.params_hash(PARAMS, "POWER-2024", "v1")
+    assert ar.find_reusable(db, ar.params_hash(PARAMS, "POWER-2024", "v2"), "POWER-2024", "v2") is None
+
+def test_provisional_end_year_is_not_reused(db):
+    params = {**PARAMS, "end_year": date.today().year}
+    assert ar.params_hash(params, "POWER-2024", "v1") is None
+    row = _save(db, params, "v1")
+    assert row.params_hash is None
+    assert ar.find_reusable(db, ar.params_hash(params, "POWER-2024", "v1"), "POWER-2024", "v1") is None
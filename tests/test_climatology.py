@@ -0,0 +1,55 @@
+# tests/test_climatology.py
+import calendar
+from datetime import date
+
+import numpy as np
+import pytest
+
+from app.datasources.power_store import PowerStore
+from app.services import climatology
+
+class _Cell:
+    def __init__(self, key):
+        self.key = key
+
+def _series(year: int, seed: int) -> np.ndarray:
+    rng = np.random.default_rng(seed * 10_000 + year)
+    return rng.normal(20, 5, 366 if calendar.isleap(year) else 365)
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    s = PowerStore(tmp_path)
+    monkeypatch.setattr(climatology, "store", s)
+    return s
+
+def _fill(store, cell, var, first, last, seed):
+    for y in range(first, last + 1):
+        store.put(cell, var, y, _series(y, seed))
+
+def _expected(store, cell, var, first, last, month, day, years, w):
+    values = np.concatenate([np.asarray(store.get(cell, var, y)) for y in range(first, last + 1)])
+    origin = date(first, 1, 1)
+    return np.array([np.median(values[(date(y, month, day) - origin).days - w:
+                                      (date(y, month, day) - origin).days + w + 1]) for y in years])
+
+def test_lookup_many_checks_bounds_per_run_length(store):
+    # mismo año de inicio, distinto fin: T2M 1990-2000, RH2M 1990-2020
+    _fill(store, "len-a", "T2M", 1990, 2000, seed=1)
+    _fill(store, "len-a", "RH2M", 1990, 2020, seed=2)
+    cell = _Cell("len-a")
+
+    # la ventana de 2000 cruza a 2001, que T2M no tiene: el índice no cubre la consulta
+    out = climatology.lookup_many(cell, ["RH2M", "T2M"], [(12, 31)], 1990, 2000, 10)
+    assert out == [None]
+    out = climatology.lookup_many(cell, ["T2M", "RH2M"], [(12, 31)], 1990, 2000, 10)
+    assert out == [None]
+
+def test_lookup_many_matches_direct_medians_with_mismatched_runs(store):
+    _fill(store, "len-b", "T2M", 1990, 2000, seed=3)
+    _fill(store, "len-b", "RH2M", 1990, 2020, seed=4)
+    cell = _Cell("len-b")
+    years = list(range(1990, 2001))
+
+    (per_year, _), = climatology.lookup_many(cell, ["RH2M", "T2M"], [(6, 15)], 1990, 2000, 10)
+    np.testing.assert_allclose(per_year["T2M"], _expected(store, "len-b", "T2M", 1990, 2000, 6, 15, years, 10))
+    np.testing.assert_allclose(per_year["RH2M"], _expected(store, "len-b", "RH2M", 1990, 2020, 6, 15, years, 10))